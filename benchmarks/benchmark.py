@@ -0,0 +1,255 @@
+# Benchmarks of the pystq hot paths. Every run appends one JSON record per
+# benchmark to a history file, and compares the timings against the last
+# record of the same benchmark so that regressions stand out.
+#
+# Usage: python benchmarks/benchmark.py [--quick] [--history FILE]
+#                                       [--threshold RATIO]
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import timeit
+
+import numpy as np
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+
+import pystq.noise as noise
+import pystq.score as score
+import pystq.sites as sites
+import pystq.materials as materials
+from pystq.detector import Detector, DetectorBatch
+import userDefinedNoise
+
+# Design used by every benchmark
+design = {
+   'freqrange': (0, 4),
+   'site': sites.Jungle,
+   'depth': 100.0,
+   'pumps': 8,
+   'temperature': 120.0,
+   'sus_stages': 4,
+   'sus_length': 2.0,
+   'mirror_mass': 40.0,
+   'power': 80.0,
+   'material': materials.Silicon,
+   'roughness': 50
+}
+
+
+# A user model written for scalar frequencies only, which the score
+# calculator has to evaluate point by point
+class ScalarUserNoise:
+
+   @staticmethod
+   def GetScalarUserNoise(f, detector):
+      if f < 10:
+         return 1E-21 / f
+      return 1E-22
+
+   @classmethod
+   def ComputePoint(cls, f, detector):
+      return cls.GetScalarUserNoise(f, detector)
+
+
+# Noise model mixes: models added with SetNoiseModels, and the keys of the
+# models switched on (None for all of them)
+mixes = {
+   'default': ({}, None),
+   'shot': ({}, ['Shot']),
+   'user': ({
+      'GravGrad': userDefinedNoise.GravGrad(),
+      'Alien Landing': userDefinedNoise.AlienLandingNoise()
+   }, None),
+   'scalar-user': ({
+      'Scalar User': ScalarUserNoise()
+   }, None)
+}
+
+
+def MakeCalculator(detector, nData, mix):
+   newModels, used = mixes[mix]
+   calculator = score.ScoreCalculator(detector)
+   calculator.SetFreqRange(*design['freqrange'])
+   calculator.nData = nData
+   calculator.SetNoiseModels(newModels)
+   if used is not None:
+      for key in calculator.noiseModels:
+         calculator.SetNoiseUsed(key, key in used)
+   return calculator
+
+
+# Batch of n copies of the design with the masses and powers spread out
+def MakeBatch(n):
+   columns = {key: np.full(n, float(design[key]))
+              for key in Detector().limits if key != 'freqrange'}
+   columns['mirror_mass'] = np.linspace(5, 100, n)
+   columns['power'] = np.linspace(1, 200, n)
+   columns['site'] = np.arange(n) % len(sites.allSites)
+   columns['material'] = np.arange(n) % len(materials.allMaterials)
+   return DetectorBatch(columns, design['freqrange'])
+
+
+# Best time per call of func in seconds
+def TimeCall(func, repeat):
+   timer = timeit.Timer(func)
+   number, _ = timer.autorange()
+   return min(timer.repeat(repeat, number)) / number
+
+
+# List of (name, parameters, callable) to time
+def Benchmarks(quick):
+   nDatas = [100, 1000] if quick else [100, 1000, 10000]
+   batchSizes = [10, 100] if quick else [10, 100, 1000]
+   detector = Detector(design)
+   cases = []
+
+   for nData in nDatas:
+      for mix in mixes:
+         calculator = MakeCalculator(detector, nData, mix)
+         params = {'nData': nData, 'mix': mix}
+
+         def noiseCurves(calculator=calculator):
+            calculator.curveCache.clear()
+            calculator.GetNoiseCurves()
+
+         cases.append(('GetNoiseCurves', params, noiseCurves))
+         cases.append(('GetNoiseCurves[cached]', params,
+                       calculator.GetNoiseCurves))
+         cases.append(('CalcScore', params, calculator.CalcScore))
+         cases.append(('GetDetectorDistance', params,
+                       lambda c=calculator: c.GetDetectorDistance(1.7, 1.7)))
+         cases.append(('Supernovae', params, calculator.Supernovae))
+
+      f = np.logspace(0, 4, nData)
+      for name in ['GravityGradientNoise', 'SeismicNoise',
+                   'MirrorThermalNoise', 'RadiationPressureNoise',
+                   'ResidualGas', 'ShotNoise', 'SuspThermalNoise']:
+         model = getattr(noise, name)
+         cases.append((name + '.ComputePoint', {'nData': nData},
+                       lambda m=model, f=f: m.ComputePoint(f, detector)))
+
+   cases.append(('CalcCost', {'batch': 0},
+                 lambda: score.CalcCost(detector)))
+   cases.append(('CalcComplex', {'batch': 0},
+                 lambda: score.CalcComplex(detector)))
+
+   for n in batchSizes:
+      batch = MakeBatch(n)
+      calculator = MakeCalculator(batch, 1000, 'default')
+      params = {'batch': n, 'nData': 1000, 'mix': 'default'}
+      cases.append(('CalcScore', params, calculator.CalcScore))
+      cases.append(('GetNoiseCurves', params, calculator.GetNoiseCurves))
+      cases.append(('CalcCost', {'batch': n},
+                    lambda b=batch: score.CalcCost(b)))
+      cases.append(('CalcComplex', {'batch': n},
+                    lambda b=batch: score.CalcComplex(b)))
+   return cases
+
+
+# Modules of the headless core, and the startup budget for importing them
+coreModules = ['pystq.detector', 'pystq.noise', 'pystq.score']
+importBudget = 0.3
+# Modules the core must not pull in at import time
+heavyModules = ['scipy', 'bokeh', 'ipywidgets', 'IPython']
+
+
+# Time to import the core modules in a fresh interpreter, and the heavy
+# modules that were loaded on the way
+def TimeCoreImport(repeat):
+   script = (
+      'import sys, time, json\n'
+      't = time.perf_counter()\n'
+      'import {}\n'
+      't = time.perf_counter() - t\n'
+      'heavy = [m for m in {} if m in sys.modules]\n'
+      'print(json.dumps([t, heavy]))\n').format(', '.join(coreModules),
+                                                 heavyModules)
+   results = []
+   for i in range(repeat):
+      output = subprocess.check_output([sys.executable, '-c', script],
+                                       cwd=os.path.dirname(here))
+      results.append(json.loads(output.decode('utf-8')))
+   return min(t for t, heavy in results), results[0][1]
+
+
+def GitRevision():
+   try:
+      return subprocess.check_output(
+         ['git', 'rev-parse', '--short', 'HEAD'], cwd=here,
+         stderr=subprocess.DEVNULL).decode('utf-8').strip()
+   except Exception:
+      return ''
+
+
+# Last recorded time of every benchmark in the history file
+def LoadHistory(path):
+   last = {}
+   if os.path.isfile(path):
+      with open(path) as f:
+         for line in f:
+            record = json.loads(line)
+            last[(record['name'], json.dumps(record['params'],
+                                             sort_keys=True))] = record
+   return last
+
+
+def main():
+   parser = argparse.ArgumentParser(description='Benchmark pystq hot paths')
+   parser.add_argument('--quick', action='store_true',
+                       help='fewer grid and batch sizes')
+   parser.add_argument('--history', default=os.path.join(here,
+                                                         'history.jsonl'),
+                       help='JSON lines file the results are appended to')
+   parser.add_argument('--threshold', type=float, default=1.25,
+                       help='slow-down ratio reported as a regression')
+   parser.add_argument('--repeat', type=int, default=5)
+   args = parser.parse_args()
+
+   previous = LoadHistory(args.history)
+   run = {
+      'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+      'revision': GitRevision(),
+      'python': platform.python_version(),
+      'numpy': np.__version__,
+      'machine': platform.machine()
+   }
+   regressions = 0
+   with open(args.history, 'a') as history:
+      for name, params, func in Benchmarks(args.quick):
+         seconds = TimeCall(func, args.repeat)
+         record = dict(run, name=name, params=params, seconds=seconds)
+         history.write(json.dumps(record) + '\n')
+
+         key = (name, json.dumps(params, sort_keys=True))
+         note = ''
+         if key in previous:
+            ratio = seconds / previous[key]['seconds']
+            note = '{:.2f}x vs {}'.format(ratio, previous[key]['revision'])
+            if ratio > args.threshold:
+               note += '  REGRESSION'
+               regressions += 1
+         print('{:<36} {:<44} {:>12.1f} us  {}'.format(
+            name, json.dumps(params, sort_keys=True), seconds * 1E6, note))
+
+      seconds, heavy = TimeCoreImport(args.repeat)
+      history.write(json.dumps(dict(run, name='import core', params={},
+                                    seconds=seconds, heavy=heavy)) + '\n')
+      note = 'budget {:.0f} ms'.format(importBudget * 1E3)
+      if seconds > importBudget or len(heavy) > 0:
+         note += '  OVER BUDGET' + (' (loads {})'.format(', '.join(heavy))
+                                    if heavy else '')
+         regressions += 1
+      print('{:<36} {:<44} {:>12.1f} us  {}'.format(
+         'import core', ', '.join(coreModules), seconds * 1E6, note))
+   print('{} regression(s)'.format(regressions))
+   return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+   sys.exit(main())
@@ -0,0 +1,222 @@
+import hashlib
+import os
+import tempfile
+import types
+from collections import OrderedDict
+from collections.abc import Mapping
+
+import numpy as np
+
+# Results are cached under this directory unless another one is given
+defaultDirectory = os.path.join(os.path.expanduser('~'), '.cache', 'pystq')
+
+# Increase when a change to the models alters results, so that results
+# cached by older versions are no longer found
+cacheVersion = 1
+
+
+# Canonical, hashable form of a value for cache keys. Numbers are rounded to
+# 10 significant digits, so that values that differ only by round-off (or
+# an int and the equal float) share a key, and classes are named by module
+# and qualified name.
+def Canonical(value):
+   if isinstance(value, numberTypes) and not isinstance(value, boolTypes):
+      return '%.10g' % value
+   if isinstance(value, (str, bool, np.bool_)) or value is None:
+      return value
+   if isinstance(value, type):
+      return value.__module__ + '.' + value.__qualname__
+   if isinstance(value, (tuple, list, np.ndarray)):
+      return tuple(map(Canonical, value))
+   if isinstance(value, Mapping):
+      return tuple((key, Canonical(value[key])) for key in sorted(value))
+   return repr(value)
+
+
+numberTypes = (int, float, np.integer, np.floating)
+boolTypes = (bool, np.bool_)
+
+
+# Identity of a noise model for cache keys: its class, the expression of a
+# compiled noise and a fingerprint of its code, so that results of a model
+# that is edited but keeps its name are not found. Wrapped models are
+# identified by the model they wrap. Changes to functions a model calls
+# outside its class are not noticed, see cacheVersion.
+def ModelIdentity(model):
+   model = getattr(model, 'model', model)
+   cls = model if isinstance(model, type) else type(model)
+   return (cls.__module__ + '.' + cls.__qualname__ + ':' +
+           getattr(model, 'expression', '') + ':' + CodeFingerprint(cls))
+
+
+# Functions and constants defined in the body of a class and its bases, as
+# (name, value) pairs. Functions are given by their code objects.
+def ModelCode(cls):
+   members = []
+   for base in cls.__mro__:
+      if base is object:
+         continue
+      for name in sorted(base.__dict__):
+         if name.startswith('__'):
+            continue
+         value = base.__dict__[name]
+         value = getattr(value, '__func__', value)
+         code = getattr(value, '__code__', None)
+         if code is not None:
+            members.append((name, code))
+         elif isinstance(value, numberTypes + (str, tuple)):
+            members.append((name, value))
+   return members
+
+
+def CodeFingerprint(cls):
+   digest = hashlib.sha1()
+   for name, value in ModelCode(cls):
+      digest.update(name.encode())
+      UpdateDigest(digest, value)
+   return digest.hexdigest()
+
+
+# Add a code object, including the functions nested in it, or a constant to
+# digest
+def UpdateDigest(digest, value):
+   if isinstance(value, types.CodeType):
+      digest.update(value.co_code)
+      digest.update(repr(value.co_names).encode())
+      for constant in value.co_consts:
+         UpdateDigest(digest, constant)
+   elif isinstance(value, frozenset):
+      # The order of a set of strings changes between sessions
+      digest.update(repr(sorted(map(repr, value))).encode())
+   else:
+      digest.update(repr(value).encode())
+
+
+# Results stored as .npy files in a directory, one per key, read back as
+# memory maps. The most recently used entries are also held in memory. When
+# the files take more than maxBytes the least recently used are deleted;
+# file modification times record their use, so that the order survives
+# restarts and is shared with other processes using the same directory.
+class ResultCache:
+
+   def __init__(self, directory=defaultDirectory, maxBytes=256 * 2**20,
+                memoryEntries=256):
+      self.directory = directory
+      self.maxBytes = maxBytes
+      self.memoryEntries = memoryEntries
+      os.makedirs(directory, exist_ok=True)
+      # Entries held in memory, and the size of every file, both in order of
+      # last use. The files are listed when the size is first needed.
+      self.memory = OrderedDict()
+      self.index = None
+      self.directoryTime = None
+      self.size = 0
+      self.hits = 0
+      self.misses = 0
+
+   # Key for the given parts, which are made canonical first
+   @staticmethod
+   def Key(*parts):
+      return hashlib.sha1(repr(Canonical(parts)).encode()).hexdigest()
+
+   def Path(self, key):
+      return os.path.join(self.directory, key + '.npy')
+
+   # Stored array for key, or None if there is none. The array is
+   # read-only.
+   def Get(self, key):
+      if key in self.memory:
+         self.memory.move_to_end(key)
+         self.hits += 1
+         return self.memory[key]
+      try:
+         value = np.load(self.Path(key), mmap_mode='r')
+         os.utime(self.Path(key))
+      except (OSError, ValueError):
+         self.misses += 1
+         return None
+      if self.index is not None and key in self.index:
+         self.index.move_to_end(key)
+      self.Remember(key, value)
+      self.hits += 1
+      return value
+
+   # Store value for key. Other processes using the directory are noticed
+   # by its modification time, and their files are then counted too.
+   def Put(self, key, value):
+      # The stored copy is read-only, as every Get hands it out again
+      value = np.array(value)
+      value.setflags(write=False)
+      changed = self.index is None or \
+         self.DirectoryTime() != self.directoryTime
+      # Written under a temporary name and moved into place, so that other
+      # processes never read a partly written file
+      handle, temporary = tempfile.mkstemp(dir=self.directory,
+                                           suffix='.tmp')
+      try:
+         with os.fdopen(handle, 'wb') as file:
+            np.save(file, value)
+         os.replace(temporary, self.Path(key))
+      except OSError:
+         if os.path.exists(temporary):
+            os.remove(temporary)
+         return
+      self.Remember(key, value)
+      if changed:
+         self.LoadIndex()
+      else:
+         self.size -= self.index.pop(key, 0)
+         self.index[key] = os.path.getsize(self.Path(key))
+         self.size += self.index[key]
+      self.Evict()
+      self.directoryTime = self.DirectoryTime()
+
+   def DirectoryTime(self):
+      try:
+         return os.stat(self.directory).st_mtime_ns
+      except OSError:
+         return None
+
+   def Remember(self, key, value):
+      self.memory[key] = value
+      self.memory.move_to_end(key)
+      while len(self.memory) > self.memoryEntries:
+         self.memory.popitem(last=False)
+
+   # List the files in the directory, oldest first
+   def LoadIndex(self):
+      entries = []
+      for name in os.listdir(self.directory):
+         if name.endswith('.npy'):
+            try:
+               stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+               continue
+            entries.append((stat.st_mtime, name[:-4], stat.st_size))
+      entries.sort()
+      self.index = OrderedDict((key, size) for _, key, size in entries)
+      self.size = sum(self.index.values())
+
+   # Delete the least recently used files until they fit in maxBytes
+   def Evict(self):
+      while self.size > self.maxBytes and len(self.index) > 1:
+         key, size = self.index.popitem(last=False)
+         self.size -= size
+         self.memory.pop(key, None)
+         try:
+            os.remove(self.Path(key))
+         except OSError:
+            pass
+
+   # Forget every stored result
+   def Clear(self):
+      if self.index is None:
+         self.LoadIndex()
+      for key in self.index:
+         try:
+            os.remove(self.Path(key))
+         except OSError:
+            pass
+      self.index.clear()
+      self.size = 0
+      self.memory.clear()
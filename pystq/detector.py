@@ -1,40 +1,198 @@
+from collections.abc import MutableMapping
+from numbers import Real
+
 import numpy as np
 import pystq.sites as sites
 import pystq.materials as materials
 from random import randrange
 
 
+# Categories that site and material are chosen from, stored in a record by
+# their index in these lists
+categories = {'site': sites.allSites, 'material': materials.allMaterials}
+
+
+# True for user actions with integer limits, other than freqrange
+def IntegerAction(action):
+   return action[2] is not None and action[0] != 'freqrange' and \
+      all(type(lim) is int for lim in action[2])
+
+
+# Field of the record of a Detector holding the parameter of a user action
+def FieldType(action):
+   if action[0] in categories or IntegerAction(action):
+      return (action[0], np.int64)
+   if action[0] == 'freqrange':
+      return (action[0], np.float64, (2,))
+   return (action[0], np.float64)
+
+
+# Dictionary-like access to the parameters of one detector held in a numpy
+# structured record. Numbers are stored as floats, or integers for keys with
+# integer limits, freqrange as a pair and site and material as indices into
+# categories; reading them gives back numbers, a tuple and the site and
+# material classes. Sites and materials can be set by class, option name or
+# index. Values that do not fit the record, such as a user-defined site
+# class or a fraction for an integer key, and keys that are not in it are
+# kept in a small dictionary instead.
+class DetectorParameters(MutableMapping):
+
+   # With view=True the record belongs to an array shared with others, and
+   # values that do not fit it raise ValueError rather than being kept
+   # apart from the array.
+   def __init__(self, record, options, view=False):
+      self.record = record
+      self.options = options
+      self.view = view
+      self.extra = {}
+
+   def __getitem__(self, key):
+      if key in self.extra:
+         return self.extra[key]
+      value = self.record[key]
+      if key in categories:
+         return categories[key][value]
+      if key == 'freqrange':
+         return tuple(value.tolist())
+      return value.item()
+
+   def __setitem__(self, key, value):
+      if key not in self.record.dtype.names:
+         self.extra[key] = value
+         return
+      try:
+         if key in categories:
+            value = self.CategoryIndex(key, value)
+         elif key != 'freqrange' and not isinstance(value, Real):
+            raise TypeError(key + ' is not a number')
+         elif self.record.dtype[key].kind == 'i' and value != int(value):
+            raise ValueError(key + ' is not an integer')
+         self.record[key] = value
+         self.extra.pop(key, None)
+      except (TypeError, ValueError, OverflowError) as error:
+         if self.view:
+            raise ValueError('{} = {!r} does not fit the record'.format(
+               key, value)) from error
+         self.extra[key] = value
+
+   def __delitem__(self, key):
+      del self.extra[key]
+
+   def __contains__(self, key):
+      return key in self.record.dtype.names or key in self.extra
+
+   def __iter__(self):
+      yield from self.record.dtype.names
+      for key in self.extra:
+         if key not in self.record.dtype.names:
+            yield key
+
+   def __len__(self):
+      return len(list(iter(self)))
+
+   def __repr__(self):
+      return repr(dict(self))
+
+   def CategoryIndex(self, key, value):
+      if value in categories[key]:
+         return categories[key].index(value)
+      if value in self.options[key]:
+         return self.options[key].index(value)
+      if type(value) is int and 0 <= value < len(categories[key]):
+         return value
+      raise ValueError('Unknown {}: {}'.format(key, value))
+
+
 class Detector:
+   # A single configuration; see DetectorBatch for many at once
+   shape = ()
+
+   # The user actions, as (key, name, limit, tag, default parameter)
+   actions = [
+      ('freqrange', 'Frequency range [loq(Hz)]', (-4, 5), 'Office', (0, 4)),
+      ('site', 'Location', None, 'Office', sites.Jungle),
+      ('depth', 'Depth [m]', (0.0, 1000.0), 'Environment', -1),
+      ('pumps', 'No. vacuum pumps', (1, 16), 'Environment', -1),
+      ('temperature', 'Temperature [K]', (1.0, 330.0), 'Environment', -1),
+      ('sus_stages', 'No. suspension stages', (1, 9), 'Suspension', -1),
+      ('sus_length', 'Suspension length [m]', (0.35, 5.0), 'Suspension', -1),
+      ('mirror_mass', 'Mirror mass [kg]', (5.0, 100.0), 'Suspension', -1),
+      ('power', 'Laser power [W]', (1.0, 200.0), 'Optics', -1),
+      ('material', 'Material', None, 'Optics', materials.Silicon),
+      ('roughness', 'Roughness [nm]', (1, 500), 'Optics', -1)]
+
+   # Metadata shared by every Detector. set_action gives a detector its own
+   # copies before changing them. constants and options below are copied
+   # for every detector.
+   names = {action[0]: action[1] for action in actions}
+   limits = {action[0]: action[2] for action in actions
+             if action[2] is not None}
+   tags = {action[0]: action[3] for action in actions}
+
+   # Other, constant parameters
+   constants = {}
+   # Detector Length (m)
+   constants['L'] = 5000
+   # Detector Finesse
+   constants['F'] = 60
+   # Laser Wavelength (m)
+   constants['Lambda'] = 1064E-9
+   # Detector Power Recycling factor
+   constants['C'] = 100
+   # First Mirror Resonance (Hz)
+   constants['fmr'] = 4000
+   # Vacuum pump cost
+   constants['vacuumPumpCost'] = 850000
+   # Initial ambient temperature (K)
+   constants['initAmbientTemp'] = 300
+   # Temperature increase per km (K)
+   constants['tempIncPerKm'] = 30
+   # Depth complexity, X
+   constants['depthComplexityX'] = np.array([0, 10, 100, 500])
+   # Depth complexity, Y
+   constants['depthComplexityY'] = np.array([0, 1, 4, 6])
+
+   options = {}
+   options['material'] = ['Crystal', 'Silicon', 'Sapphire', 'Silica']
+   options['site'] = ['City', 'Jungle', 'Desert', 'Island']
+
+   # Keys with integer limits, stored as integers
+   integerKeys = [action[0] for action in actions if IntegerAction(action)]
+
+   # Layout of the parameters of one detector: 96 bytes, so that large
+   # numbers of designs can be held in a single array of records
+   recordType = np.dtype([FieldType(action) for action in actions])
+   defaultRecord = np.array(
+      tuple(categories[action[0]].index(action[4])
+            if action[0] in categories else action[4] for action in actions),
+      dtype=recordType)
+
    # Detector takes dictionary as argument. This can then be passed around.
-   def __init__(self, dictionary={}):
-
-      self.names = {}
-      self.limits = {}
-      self.parameters = {}
-      self.tags = {}
-
-      # define user actions as
-      # set_action(key, name, limit, tag = "Other", parameter = -1):
-      self.set_action('freqrange', 'Frequency range [loq(Hz)]',  (-4, 5), "Office", parameter = (0, 4))
-      self.set_action('site', 'Location', None, 'Office', parameter =  sites.Jungle)
-      self.set_action('depth', 'Depth [m]', (0.0, 1000.0), 'Environment')
-      self.set_action('pumps', 'No. vacuum pumps', (1, 16), 'Environment')
-      self.set_action('temperature', 'Temperature [K]', (1.0, 330.0), 'Environment')
-      self.set_action('sus_stages', 'No. suspension stages', (1, 9), 'Suspension')
-      self.set_action('sus_length', 'Suspension length [m]', (0.35, 5.0), 'Suspension')
-      self.set_action('mirror_mass', 'Mirror mass [kg]', (5.0, 100.0), 'Suspension')
-      self.set_action('power', 'Laser power [W]', (1.0, 200.0), 'Optics')
-      self.set_action('material', 'Material', None,  'Optics',  parameter = materials.Silicon)
-      self.set_action('roughness', 'Roughness [nm]', (1, 500), 'Optics') 
-      
+   # Passing a record, such as an element of an array from Records, makes
+   # the detector a view of it rather than a copy.
+   def __init__(self, dictionary={}, record=None):
+      randomise = record is None
+      if record is None:
+         record = Detector.defaultRecord.copy()
+      # Every detector may change its own constants and options
+      self.constants = dict(Detector.constants)
+      self.options = {key: list(Detector.options[key])
+                      for key in Detector.options}
+      self.parameters = DetectorParameters(record, self.options,
+                                           view=not randomise)
+
       # Now set random initial values based on constraints in self.limits.
-      # Do float for float limits, int for int limits and nothing for others
+      # Do float for float limits, int for int limits and nothing for others.
+      # A detector viewing a record keeps its values. For reproducible
+      # designs, see population.RandomPopulation.
       for key in self.limits:
-          if type(self.limits[key]) is float:
+          if not randomise or key == 'freqrange':
+             continue
+          if all(type(lim) is float for lim in self.limits[key]):
              lim_diff = self.limits[key][1] - self.limits[key][0]
              rand_float = float(randrange(1, 100)) / 100.0
              self.parameters[key] = self.limits[key][0] + rand_float * lim_diff
-          if type(self.limits[key]) is int:
+          if all(type(lim) is int for lim in self.limits[key]):
              lim_diff = self.limits[key][1] - self.limits[key][0]
              rand_float = float(randrange(1, 100)) / 100.0
              self.parameters[key] = int(self.limits[key][0] + rand_float * lim_diff)
@@ -43,36 +201,129 @@ class Detector:
       for key in dictionary:
          self.parameters[key] = dictionary[key]
 
-      # Other, constant parameters
-      self.constants = {}
-      # Detector Length (m)
-      self.constants['L'] = 5000
-      # Detector Finesse
-      self.constants['F'] = 60
-      # Laser Wavelength (m)
-      self.constants['Lambda'] = 1064E-9
-      # Detector Power Recycling factor
-      self.constants['C'] = 100
-      # First Mirror Resonance (Hz)
-      self.constants['fmr'] = 4000
-      # Vacuum pump cost
-      self.constants['vacuumPumpCost'] = 850000
-      # Initial ambient temperature (K)
-      self.constants['initAmbientTemp'] = 300
-      # Temperature increase per km (K)
-      self.constants['tempIncPerKm'] = 30
-      # Depth complexity, X
-      self.constants['depthComplexityX'] = np.array([0, 10, 100, 500])
-      # Depth complexity, Y
-      self.constants['depthComplexityY'] = np.array([0, 1, 4, 6])
-
-      self.options = {}
-      self.options['material'] = ['Crystal', 'Silicon', 'Sapphire', 'Silica']
-      self.options['site'] = ['City', 'Jungle', 'Desert', 'Island']
-      
+   # The structured record holding the parameters
+   @property
+   def record(self):
+      return self.parameters.record
+
+   # Array of n records with the default parameters
+   @classmethod
+   def Records(cls, n):
+      return np.full(n, cls.defaultRecord)
+
+   # Detector viewing element i of an array of records
+   @classmethod
+   def View(cls, records, i):
+      return cls(record=records[i])
+
    def set_action(self, key, name, limit, tag = "Other", parameter = -1):
+      if self.names is Detector.names:
+         self.names = dict(self.names)
+         self.limits = dict(self.limits)
+         self.tags = dict(self.tags)
       self.names[key] = name
       if limit is not None:
           self.limits[key] = limit
       self.parameters[key] = parameter
       self.tags[key] = tag
+
+
+class DetectorBatch:
+   # Struct-of-arrays counterpart of Detector holding N configurations.
+   # Every numeric parameter is a column of length N, while site and material
+   # are stored as categorical indices into sites.allSites and
+   # materials.allMaterials. The parameters dictionary has the same keys as
+   # the one of Detector, so the noise models and CalcCost/CalcComplex
+   # broadcast over the whole batch. All configurations share one frequency
+   # range.
+   def __init__(self, columns, freqrange=(0, 4)):
+      self.names = Detector.names
+      self.limits = Detector.limits
+      self.tags = Detector.tags
+      self.constants = dict(Detector.constants)
+      self.options = {key: list(Detector.options[key])
+                      for key in Detector.options}
+
+      self.keys = [key for key in self.limits if key != 'freqrange']
+      missing = [key for key in self.keys if key not in columns]
+      if len(missing) > 0:
+         raise ValueError('Missing detector parameter columns: ' +
+                          ', '.join(missing))
+
+      self.columns = {}
+      for key in self.keys:
+         self.columns[key] = np.asarray(columns[key], dtype=float)
+      self.size = len(self.columns[self.keys[0]])
+      self.shape = (self.size,)
+      self.siteIndex = self.CategoryIndex(
+         columns.get('site', sites.Jungle), sites.allSites, 'site')
+      self.materialIndex = self.CategoryIndex(
+         columns.get('material', materials.Silicon), materials.allMaterials,
+         'material')
+
+      self.parameters = dict(self.columns)
+      self.parameters['freqrange'] = freqrange
+      self.parameters['site'] = sites.SiteColumns(self.siteIndex)
+      self.parameters['material'] = materials.MaterialColumns(
+         self.materialIndex)
+
+   def __len__(self):
+      return self.size
+
+   # Convert site or material values given as indices, classes or option
+   # names (single values or sequences) into an index array of length N
+   def CategoryIndex(self, values, classes, key):
+      if isinstance(values, np.ndarray) and values.dtype.kind in 'iu':
+         unknown = (values < 0) | (values >= len(classes))
+         if np.any(unknown):
+            raise ValueError('Unknown {}: {}'.format(key, values[unknown][0]))
+         return values.astype(int)
+      if np.ndim(values) == 0:
+         values = [values] * self.size
+      index = np.empty(self.size, dtype=int)
+      for i, value in enumerate(values):
+         if value in classes:
+            index[i] = classes.index(value)
+         elif value in self.options[key]:
+            index[i] = self.options[key].index(value)
+         elif isinstance(value, (int, np.integer)) and \
+               not isinstance(value, bool) and 0 <= value < len(classes):
+            index[i] = value
+         else:
+            raise ValueError('Unknown {}: {}'.format(key, value))
+      return index
+
+   # Build a batch from a list of Detector objects
+   @classmethod
+   def FromDetectors(cls, detectors):
+      columns = {}
+      for key in detectors[0].limits:
+         if key != 'freqrange':
+            columns[key] = [d.parameters[key] for d in detectors]
+      columns['site'] = [d.parameters['site'] for d in detectors]
+      columns['material'] = [d.parameters['material'] for d in detectors]
+      return cls(columns, detectors[0].parameters['freqrange'])
+
+   # Build a batch from an array of records (see Detector.Records). The
+   # float columns are views of the records rather than copies, and the
+   # frequency range is taken from the first one.
+   @classmethod
+   def FromRecords(cls, records):
+      columns = {key: records[key] for key in records.dtype.names
+                 if key != 'freqrange'}
+      return cls(columns, tuple(records['freqrange'][0].tolist()))
+
+   # Batch of the configurations selected by rows, an index array or mask
+   def Take(self, rows):
+      columns = {key: self.columns[key][rows] for key in self.keys}
+      columns['site'] = self.siteIndex[rows]
+      columns['material'] = self.materialIndex[rows]
+      return DetectorBatch(columns, self.parameters['freqrange'])
+
+   # Extract configuration i as a stand-alone Detector
+   def GetDetector(self, i):
+      dictionary = {key: self.columns[key][i].item() for key in self.keys}
+      dictionary['freqrange'] = self.parameters['freqrange']
+      dictionary['site'] = sites.allSites[self.siteIndex[i]]
+      dictionary['material'] = materials.allMaterials[self.materialIndex[i]]
+      return Detector(dictionary)
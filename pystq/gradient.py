@@ -0,0 +1,116 @@
+import numpy as np
+import pystq.utils as utils
+from pystq.detector import Detector, DetectorBatch
+from pystq.score import (CalcCost, DistanceFromIntegral, EvaluateNoiseModel,
+                         GetBinaryTerms)
+
+# Keys of Detector.limits that vary continuously (those with float limits)
+continuousKeys = [key for key in Detector.limits if key != 'freqrange' and
+                  all(type(lim) is float for lim in Detector.limits[key])]
+
+
+# Derivative of the log of the noise of model with respect to key on the
+# frequencies f, shaped like EvaluateNoiseModel, or None if the model has no
+# analytic form for it
+def EvaluateLogDerivative(model, key, f, detector):
+   logDerivative = getattr(model, 'LogDerivative', None)
+   if logDerivative is None:
+      return None
+   fDims = np.ndim(f)
+   dDims = len(detector.shape)
+   fColumn = np.reshape(f, np.shape(f) + (1,) * dDims)
+   value = logDerivative(fColumn, detector, key)
+   if value is None:
+      return None
+   value = np.broadcast_to(value, np.shape(f) + detector.shape)
+   return np.moveaxis(value, list(range(fDims)),
+                      list(range(dDims, dDims + fDims)))
+
+
+# Batch holding the configurations of detector with each of keys moved down
+# and up by its step, with rows ordered by key, direction and configuration
+def PerturbedBatch(detector, keys, steps):
+   if detector.shape == ():
+      detector = DetectorBatch.FromDetectors([detector])
+   n = len(detector)
+   copies = 2 * len(keys)
+   columns = {key: np.tile(detector.columns[key], copies)
+              for key in detector.keys}
+   for k, key in enumerate(keys):
+      columns[key][2 * k * n:(2 * k + 1) * n] -= steps[k]
+      columns[key][(2 * k + 1) * n:(2 * k + 2) * n] += steps[k]
+   columns['site'] = np.tile(detector.siteIndex, copies)
+   columns['material'] = np.tile(detector.materialIndex, copies)
+   return DetectorBatch(columns, detector.parameters['freqrange'])
+
+
+# Derivatives of the NS-NS and BH-BH ranges, the score and the cost of the
+# detector of calculator with respect to keys (the continuous keys by
+# default), as {quantity: {key: derivative}}, with arrays of derivatives
+# for a DetectorBatch.
+# Ranges depend on the parameters through the total PSD S(f) in
+# I = integral of f^(-7/3)/S(f), so dI/dp = -integral of f^(-7/3) dS/dp / S^2
+# and d(range)/dp = range * dI/dp / (2 I). dS/dp is the sum over the noise
+# models of 2 n dn/dp, with dn/dp from their LogDerivative where they have
+# one. Otherwise, and for the cost, central differences with steps of step
+# times the width of the limits are used, evaluated for every key at once
+# on one batch of perturbed configurations.
+# The integrals always use the grid of nData frequencies.
+def CalcGradients(calculator, keys=None, step=1E-4):
+   detector = calculator.detector
+   keys = list(keys or continuousKeys)
+   steps = np.array([step * (Detector.limits[key][1] - Detector.limits[key][0])
+                     for key in keys])
+   shape = detector.shape
+   perturbed = None
+
+   f_isco, tmp = GetBinaryTerms(np.array([1.7, 47]), np.array([1.7, 47]))
+   fHi = max(calculator.fMax, np.max(f_isco))
+   f = np.logspace(np.log10(calculator.fMin), np.log10(fHi),
+                   num=calculator.nData)
+   psd = np.zeros(shape + f.shape)
+   dPsd = np.zeros((len(keys),) + shape + f.shape)
+   for name in calculator.UsedNoises():
+      model = calculator.noiseModels[name]
+      noise = calculator.EvaluateNoise(name, f)
+      psd += noise**2
+      dependencies = getattr(model, 'dependencies', None)
+      numeric = []
+      for k, key in enumerate(keys):
+         if dependencies is not None and key not in dependencies:
+            continue
+         logDerivative = EvaluateLogDerivative(model, key, f, detector)
+         if logDerivative is None:
+            numeric.append(k)
+         else:
+            dPsd[k] += 2 * noise**2 * logDerivative
+      if len(numeric) > 0:
+         if perturbed is None:
+            perturbed = PerturbedBatch(detector, keys, steps)
+         values = EvaluateNoiseModel(model, f, perturbed).reshape(
+            (len(keys), 2) + shape + f.shape)
+         for k in numeric:
+            dPsd[k] += (values[k, 1]**2 - values[k, 0]**2) / (2 * steps[k])
+
+   f73 = np.power(f, -7 / 3)
+   integrands = np.concatenate([(f73 / psd)[np.newaxis],
+                                -f73 * dPsd / psd**2])
+   integrals = utils.CumulativeIntegral(f, integrands)(f_isco)
+   ranges = DistanceFromIntegral(tmp, integrals[0])
+   dRanges = ranges * integrals[1:] / (2 * integrals[0])
+   nsns, bhbh = ranges[..., 0], ranges[..., 1]
+   score = np.sqrt(nsns**2 + (bhbh / 10)**2)
+   dScore = (nsns * dRanges[..., 0] + bhbh * dRanges[..., 1] / 100) / score
+
+   if perturbed is None:
+      perturbed = PerturbedBatch(detector, keys, steps)
+   costs = np.reshape(CalcCost(perturbed), (len(keys), 2) + shape)
+   dCost = (costs[:, 1] - costs[:, 0]) / (2 * steps.reshape(
+      (-1,) + (1,) * len(shape)))
+
+   gradients = {}
+   for quantity, values in (('nsnsRange', dRanges[..., 0]),
+                            ('bhbhRange', dRanges[..., 1]),
+                            ('score', dScore), ('cost', dCost)):
+      gradients[quantity] = {key: values[k][()] for k, key in enumerate(keys)}
+   return gradients
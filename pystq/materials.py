@@ -6,8 +6,7 @@ class Sapphire:
    losses = 1
 
    def GetQ(detector):
-      return 1.0 / utils.LerpArray(sapphireLoss_x, sapphireLoss_y,
-                                   detector.parameters['temperature'])
+      return 1.0 / sapphireLoss(detector.parameters['temperature'])
 
    def GetCost(detector):
       return 4e6 + 56e6 * (detector.parameters['mirror_mass'] / 100)**2
@@ -17,8 +16,7 @@ class Crystal:
    losses = 0.4
 
    def GetQ(detector):
-      return 1.0 / utils.LerpArray(crystalLoss_x, crystalLoss_y,
-                                   detector.parameters['temperature'])
+      return 1.0 / crystalLoss(detector.parameters['temperature'])
 
    def GetCost(detector):
       return 5e5 + 9.5e6 * (detector.parameters['mirror_mass'] / 100)**2
@@ -28,8 +26,7 @@ class Silicon:
    losses = 1
 
    def GetQ(detector):
-      return 1.0 / utils.LerpArray(siliconLoss_x, siliconLoss_y,
-                                   detector.parameters['temperature'])
+      return 1.0 / siliconLoss(detector.parameters['temperature'])
 
    def GetCost(detector):
       return 2e6 + 38e6 * (detector.parameters['mirror_mass'] / 100)**2
@@ -39,13 +36,43 @@ class Silica:
    losses = 1
 
    def GetQ(detector):
-      return 1.0 / utils.LerpArray(silicaLoss_x, silicaLoss_y,
-                                   detector.parameters['temperature'])
+      return 1.0 / silicaLoss(detector.parameters['temperature'])
 
    def GetCost(detector):
       return 1.5e6 + 28.5e6 * (detector.parameters['mirror_mass'] / 100)**2
 
 
+# All materials, in the order of Detector.options['material']. Batches of
+# detectors store their material as an index into this list.
+allMaterials = [Crystal, Silicon, Sapphire, Silica]
+
+
+class MaterialColumns:
+   # Material properties gathered per configuration of a DetectorBatch. It
+   # offers the same interface as the material classes above, evaluating
+   # each material over the whole batch and picking the entry that belongs
+   # to every configuration. lossScale multiplies the mechanical loss read
+   # from the loss tables and losses replaces the optical losses, either as
+   # one value or one per configuration.
+   def __init__(self, index, lossScale=1, losses=None):
+      self.index = np.asarray(index, dtype=int)
+      self.lossScale = np.asarray(lossScale, dtype=float)
+      if losses is None:
+         self.losses = materialLosses[self.index]
+      else:
+         self.losses = np.broadcast_to(np.asarray(losses, dtype=float),
+                                       self.index.shape)
+
+   def GetQ(self, detector):
+      return 1.0 / (lossTables(self.index,
+                               detector.parameters['temperature']) *
+                    self.lossScale)
+
+   def GetCost(self, detector):
+      return np.choose(self.index,
+                       [m.GetCost(detector) for m in allMaterials])
+
+
 def GetRoughnessLoss(roughness):
    return (1 + 0.9 / 499) - roughness / 499 * 0.9
 
@@ -59,3 +86,15 @@ crystalLoss_x = np.array([1, 300])
 crystalLoss_y = np.array([1e-3, 1e-3])
 sapphireLoss_x = np.array([1, 25, 80, 105, 230, 300])
 sapphireLoss_y = np.array([1.4e-9, 2.5e-8, 7e-9, 1.2e-8, 1.6e-8, 1e-7])
+
+# Precomputed lookup tables of the loss data above
+silicaLoss = utils.LerpTable(silicaLoss_x, silicaLoss_y)
+siliconLoss = utils.LerpTable(siliconLoss_x, siliconLoss_y)
+crystalLoss = utils.LerpTable(crystalLoss_x, crystalLoss_y)
+sapphireLoss = utils.LerpTable(sapphireLoss_x, sapphireLoss_y)
+# The same tables in allMaterials order, searched by material index
+lossTables = utils.LerpTables([(crystalLoss_x, crystalLoss_y),
+                               (siliconLoss_x, siliconLoss_y),
+                               (sapphireLoss_x, sapphireLoss_y),
+                               (silicaLoss_x, silicaLoss_y)])
+materialLosses = np.array([m.losses for m in allMaterials], dtype=float)
@@ -0,0 +1,140 @@
+import numpy as np
+from pystq.detector import DetectorBatch
+from pystq.materials import MaterialColumns
+from pystq.score import ScoreCalculator
+from pystq.sites import SiteColumns
+
+
+# Distributions of uncertain inputs. Each returns a function drawing an array
+# of n samples from a numpy random Generator; any such function can be used
+# in place of these.
+def Normal(mean, sd):
+   return lambda rng, n: rng.normal(mean, sd, n)
+
+
+# Log-normal around median, sigma being the standard deviation of the
+# natural logarithm. Suited to positive quantities known to a factor.
+def LogNormal(median, sigma):
+   return lambda rng, n: median * rng.lognormal(0, sigma, n)
+
+
+def Uniform(low, high):
+   return lambda rng, n: rng.uniform(low, high, n)
+
+
+# Monte Carlo propagation of uncertain site and material data through the
+# noise curves, ranges, score and cost of a single detector design. The
+# samples are scored together as DetectorBatch objects of identical
+# configurations, each carrying its own site constants and material losses.
+class MonteCarlo:
+
+   # Largest number of samples scored in one batch
+   maxChunkSize = 4096
+   # Quantities that can be sampled besides the site constants of
+   # SiteColumns.fields: a factor on the mechanical loss of the material
+   # loss tables, and the optical losses of the material.
+   materialFields = ['lossScale', 'losses']
+
+   # distributions maps sampled quantities to distributions as above. Site
+   # constants and optical losses that are not sampled keep the values of
+   # the site and material of the detector, and lossScale defaults to 1.
+   # Percentile bands of the noise curves are taken over the first
+   # curveSamples samples only, as every curve holds nData values.
+   def __init__(self, detector, distributions, samples=10000, seed=None,
+                percentiles=(5, 50, 95), curveSamples=1000, chunkSize=None,
+                noiseModels={}, noisesUsed={}):
+      unknown = [key for key in distributions
+                 if key not in SiteColumns.fields + self.materialFields]
+      if len(unknown) > 0:
+         raise ValueError('Cannot sample: ' + ', '.join(unknown))
+      self.detector = detector
+      self.distributions = dict(distributions)
+      self.samples = int(samples)
+      self.rng = np.random.default_rng(seed)
+      self.percentiles = np.asarray(percentiles, dtype=float)
+      self.curveSamples = min(int(curveSamples), self.samples)
+      self.chunkSize = chunkSize or min(self.maxChunkSize, self.samples)
+      self.noiseModels = noiseModels
+      self.noisesUsed = noisesUsed
+      self.design = DetectorBatch.FromDetectors([detector])
+
+   # Draw n values of every sampled quantity
+   def Draw(self, n):
+      values = {}
+      for key in self.distributions:
+         values[key] = np.broadcast_to(np.asarray(
+            self.distributions[key](self.rng, n), dtype=float), (n,))
+      return values
+
+   # Batch of n copies of the detector with the sampled site constants and
+   # material data of values
+   def GetBatch(self, values, n):
+      batch = self.design.Take(np.zeros(n, dtype=int))
+      batch.parameters['site'] = SiteColumns(
+         batch.siteIndex,
+         {key: values[key] for key in values if key in SiteColumns.fields})
+      batch.parameters['material'] = MaterialColumns(
+         batch.materialIndex, values.get('lossScale', 1),
+         values.get('losses'))
+      return batch
+
+   def Calculator(self, batch):
+      return ScoreCalculator.Configured(
+         batch, self.detector.parameters['freqrange'], self.noiseModels,
+         self.noisesUsed)
+
+   # Score samples in chunks. Returns the sampled inputs, the result table
+   # of every sample (see ScoreCalculator.CalcScoreTable, with the cost as a
+   # fraction of the site budget added) and the noise curves of the first
+   # curveSamples samples as (frequencies, {name: curves}).
+   def Sample(self):
+      inputs = {key: [] for key in self.distributions}
+      tables = []
+      f = None
+      curves = {}
+      for start in range(0, self.samples, self.chunkSize):
+         n = min(self.chunkSize, self.samples - start)
+         values = self.Draw(n)
+         batch = self.GetBatch(values, n)
+         calculator = self.Calculator(batch)
+         # The scoring pass keeps the curves of the first curveSamples
+         rows = max(0, min(n, self.curveSamples - start))
+         calculator.keepCurves = rows
+         table = calculator.CalcScoreTable()
+         table['budgetFraction'] = table['cost'] / \
+            batch.parameters['site'].budget
+         tables.append(table)
+         for key in values:
+            inputs[key].append(values[key])
+         if rows > 0:
+            arrays = calculator.keptCurves
+            if arrays is None:
+               # The binaries were integrated beyond the frequency range, on
+               # another grid, so the curves are computed on their own
+               arrays = self.Calculator(self.GetBatch(
+                  {key: values[key][:rows] for key in values},
+                  rows)).GetNoiseArrays()
+            f, noise, total, names = arrays
+            for name, curve in zip(names + ['total'], list(noise) + [total]):
+               curves.setdefault(name, []).append(curve)
+      inputs = {key: np.concatenate(inputs[key]) for key in inputs}
+      table = {key: np.concatenate([t[key] for t in tables])
+               for key in tables[0]}
+      curves = {name: np.concatenate(curves[name]) for name in curves}
+      return inputs, table, (f, curves)
+
+   # Run the Monte Carlo and return a dictionary of percentile bands: one
+   # array of len(percentiles) values per field of the result table, and
+   # under 'curves' the (percentiles x frequencies) bands of every noise
+   # curve and the total. 'f' holds the frequencies of the curves, and
+   # 'inputs' and 'samples' the sampled inputs and per-sample results.
+   def Run(self):
+      inputs, table, (f, curves) = self.Sample()
+      result = {'percentiles': self.percentiles, 'f': f, 'inputs': inputs,
+                'samples': table}
+      for key in table:
+         result[key] = np.percentile(table[key], self.percentiles, axis=0)
+      result['curves'] = {
+         name: np.percentile(curves[name], self.percentiles, axis=0)
+         for name in curves}
+      return result
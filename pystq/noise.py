@@ -6,26 +6,59 @@ import pystq.materials as materials
 # Functions that are shared between multiple noise models
 #-----------------------------------------------------------------------------#
 def getXSeis(f, detector):
-   # seismic noise
-   X_0 = detector.parameters['site'].X_dc/\
-                          (1 + np.power(f/ \
-                           detector.parameters['site'].f_c, \
-                           detector.parameters['site'].n_0))
+   # seismic noise, shared by the configurations of a batch at each site
+   site = detector.parameters['site']
+   X_0 = None
+   if hasattr(site, 'PerSite'):
+      X_0 = site.PerSite(getGroundMotion, f)
+   if X_0 is None:
+      X_0 = getGroundMotion(f, site)
    # reduction of seismic noise suppression due to digging
-   X_0 = X_0 + detector.parameters['site'].X_hf
    dig = 1 / np.sqrt(
       1 + np.power(detector.parameters['depth'] / 50, 4)) + 0.8E-3
    return X_0 * dig
 
 
+# Seismic ground motion of a site
+def getGroundMotion(f, site):
+   X_0 = site.X_dc/(1 + np.power(f/site.f_c, site.n_0))
+   return X_0 + site.X_hf
+
+
+# Derivative of the log of the seismic noise suppression by digging with
+# respect to the depth
+def getDigLogDerivative(detector):
+   depth = detector.parameters['depth']
+   u = 1 + np.power(depth / 50, 4)
+   dig = 1 / np.sqrt(u) + 0.8E-3
+   return -2 * np.power(depth, 3) / np.power(50, 4) * np.power(u, -1.5) / dig
+
+
+# Derivative of GetRoughnessLoss with respect to the roughness
+roughnessLossSlope = -0.9 / 499
+
+
 def getFPfreq(detector):
    return constants.c / (4 * detector.constants['L'] * detector.constants['F'])
 
 
 #-----------------------------------------------------------------------------#
 
+# Every noise model lists the keys of detector.parameters it reads in
+# 'dependencies', so that its curve is only recomputed when one of those
+# parameters changes. Models without the attribute are always recomputed.
+# 'vectorized' marks models that take arrays of frequencies and batches of
+# detectors, and 'frequencyIndependent' those whose noise is the same at
+# every frequency (see registry.py). Models may also give the derivatives
+# of the log of their noise with respect to parameters in 'LogDerivative',
+# which returns None for parameters it has no analytic form for; those are
+# found by finite differences (see gradient.py).
+
 
 class GravityGradientNoise:
+   vectorized = True
+   # detector.parameters read by this model
+   dependencies = ['site', 'depth']
 
    @staticmethod
    def GetGravityGradientNoise(f, detector):
@@ -36,8 +69,17 @@ class GravityGradientNoise:
    def ComputePoint(cls, f, detector):
       return cls.GetGravityGradientNoise(f, detector)
 
+   @staticmethod
+   def LogDerivative(f, detector, key):
+      if key == 'depth':
+         return getDigLogDerivative(detector)
+      return None
+
 
 class SeismicNoise:
+   vectorized = True
+   # detector.parameters read by this model
+   dependencies = ['site', 'depth', 'sus_length', 'sus_stages']
 
    @staticmethod
    def GetSeismicNoise(f, detector):
@@ -55,8 +97,28 @@ class SeismicNoise:
    def ComputePoint(cls, f, detector):
       return cls.GetSeismicNoise(f, detector)
 
+   @staticmethod
+   def LogDerivative(f, detector, key):
+      if key == 'depth':
+         return getDigLogDerivative(detector)
+      Q_pend = 5
+      length = detector.parameters['sus_length']
+      stages = detector.parameters['sus_stages']
+      x = f / (np.power(constants.g / length, 0.5) / (np.pi * 2))
+      A = 1 + np.power(x, 4) - (2 - 1/Q_pend) * np.power(x, 2)
+      if key == 'sus_length':
+         # x grows with the square root of the length
+         return -stages * (2 * np.power(x, 4) -
+                           (2 - 1/Q_pend) * np.power(x, 2)) / (2 * length * A)
+      if key == 'sus_stages':
+         return -np.log(A) / 2
+      return None
+
 
 class MirrorThermalNoise:
+   vectorized = True
+   # detector.parameters read by this model
+   dependencies = ['temperature', 'mirror_mass', 'material']
 
    @staticmethod
    def GetMirrorThermalNoise(f, detector):
@@ -65,10 +127,10 @@ class MirrorThermalNoise:
       omega = np.pi * 2 * f
       omega1 = np.pi * 2 * 20505 * np.power(
          23 / detector.parameters['mirror_mass'], 0.66)
+      Q = detector.parameters['material'].GetQ(detector)
       return K1*np.sqrt(detector.parameters['temperature']*omega1**2
-         /(omega*M_eff*detector.parameters['material'].GetQ(detector)
-             *((omega1**2 - omega**2)**2 + (omega1**2/\
-                  detector.parameters['material'].GetQ(detector))**2)
+         /(omega*M_eff*Q
+             *((omega1**2 - omega**2)**2 + (omega1**2/Q)**2)
           ))
 
    @classmethod
@@ -77,6 +139,9 @@ class MirrorThermalNoise:
 
 
 class RadiationPressureNoise:
+   vectorized = True
+   # detector.parameters read by this model
+   dependencies = ['power', 'mirror_mass', 'material', 'roughness']
 
    @staticmethod
    def GetRadiationPressureNoise(f, detector):
@@ -94,8 +159,23 @@ class RadiationPressureNoise:
    def ComputePoint(cls, f, detector):
       return cls.GetRadiationPressureNoise(f, detector)
 
+   @staticmethod
+   def LogDerivative(f, detector, key):
+      if key == 'power':
+         return 0.5 / detector.parameters['power']
+      if key == 'mirror_mass':
+         return -1 / detector.parameters['mirror_mass']
+      if key == 'roughness':
+         return 0.5 * roughnessLossSlope / materials.GetRoughnessLoss(
+            detector.parameters['roughness'])
+      return None
+
 
 class ResidualGas:
+   vectorized = True
+   # detector.parameters read by this model
+   dependencies = ['pumps']
+   frequencyIndependent = True
 
    @staticmethod
    def GetResidualGas(detector):
@@ -111,6 +191,9 @@ class ResidualGas:
 
 
 class ShotNoise:
+   vectorized = True
+   # detector.parameters read by this model
+   dependencies = ['power', 'material', 'roughness']
 
    @staticmethod
    def GetShotNoise(f, detector):
@@ -126,8 +209,20 @@ class ShotNoise:
    def ComputePoint(cls, f, detector):
       return cls.GetShotNoise(f, detector)
 
+   @staticmethod
+   def LogDerivative(f, detector, key):
+      if key == 'power':
+         return -0.5 / detector.parameters['power']
+      if key == 'roughness':
+         return -5 * roughnessLossSlope / materials.GetRoughnessLoss(
+            detector.parameters['roughness'])
+      return None
+
 
 class SuspThermalNoise:
+   vectorized = True
+   # detector.parameters read by this model
+   dependencies = ['temperature', 'sus_length', 'mirror_mass']
 
    @staticmethod
    def GetSuspThermalNoise(f, detector):
@@ -145,3 +240,13 @@ class SuspThermalNoise:
    @classmethod
    def ComputePoint(cls, f, detector):
       return cls.GetSuspThermalNoise(f, detector)
+
+   @staticmethod
+   def LogDerivative(f, detector, key):
+      if key == 'temperature':
+         return 0.5 / detector.parameters['temperature']
+      if key == 'sus_length':
+         return -1 / detector.parameters['sus_length']
+      if key == 'mirror_mass':
+         return -0.25 / detector.parameters['mirror_mass']
+      return None
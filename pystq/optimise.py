@@ -0,0 +1,128 @@
+import numpy as np
+from pystq.detector import Detector, DetectorBatch
+from pystq.score import ScoreCalculator
+import pystq.sites as sites
+import pystq.materials as materials
+
+
+# Budget-constrained search for the design with the highest score.score,
+# using differential evolution (DE/rand/1/bin). Every generation is scored
+# as one DetectorBatch. Constraints follow the feasibility rules of Deb: a
+# design within budget (and within the complexity credits, if requested)
+# beats one that is not, and of two designs over the limits the one that
+# exceeds them least wins.
+class DesignOptimiser:
+
+   # site and material fix the location and mirror material, or are searched
+   # over when left as None. With complexity=True the complexCredits of the
+   # site are a constraint as well. noiseModels and noisesUsed are passed on
+   # to SetNoiseModels and SetNoiseUsed of the ScoreCalculator.
+   def __init__(self, site=None, material=None, complexity=False,
+                populationSize=40, mutation=0.7, crossover=0.9, seed=None,
+                freqrange=(0, 4), noiseModels={}, noisesUsed={}):
+      self.keys = [key for key in Detector.limits if key != 'freqrange']
+      # Keys with integer limits, such as the number of pumps, are rounded
+      self.integerKeys = [key for key in self.keys
+                          if all(type(lim) is int
+                                 for lim in Detector.limits[key])]
+      self.site = site
+      self.material = material
+      # Searched categories are encoded as continuous coordinates in
+      # [0, number of options), rounded down when decoded
+      self.categories = [(key, classes) for key, value, classes in
+                         (('site', site, sites.allSites),
+                          ('material', material, materials.allMaterials))
+                         if value is None]
+      self.lower = np.array([Detector.limits[key][0] for key in self.keys] +
+                            [0] * len(self.categories), dtype=float)
+      self.upper = np.array([Detector.limits[key][1] for key in self.keys] +
+                            [len(classes) for key, classes in self.categories],
+                            dtype=float)
+      self.complexity = complexity
+      self.populationSize = populationSize
+      self.mutation = mutation
+      self.crossover = crossover
+      self.rng = np.random.default_rng(seed)
+      self.freqrange = freqrange
+      self.noiseModels = noiseModels
+      self.noisesUsed = noisesUsed
+      # Best score per generation and number of designs scored by Run
+      self.history = []
+      self.evaluations = 0
+
+   # Parameter columns of the designs in the rows of x
+   def Decode(self, x):
+      columns = {}
+      for j, key in enumerate(self.keys):
+         if key in self.integerKeys:
+            columns[key] = np.round(x[:, j])
+         else:
+            columns[key] = x[:, j]
+      for j, (key, classes) in enumerate(self.categories):
+         columns[key] = np.minimum(np.floor(x[:, len(self.keys) + j]),
+                                   len(classes) - 1).astype(int)
+      if self.site is not None:
+         columns['site'] = self.site
+      if self.material is not None:
+         columns['material'] = self.material
+      return columns
+
+   # Score the designs in the rows of x in one batch. Returns the scores,
+   # the relative amount by which each design exceeds its limits (zero for
+   # feasible designs) and the result table.
+   def Evaluate(self, x):
+      batch = DetectorBatch(self.Decode(x), self.freqrange)
+      table = ScoreCalculator.Configured(
+         batch, self.freqrange, self.noiseModels,
+         self.noisesUsed).CalcScoreTable()
+      site = batch.parameters['site']
+      violation = np.maximum(0, table['cost'] / site.budget - 1)
+      if self.complexity:
+         violation += np.maximum(
+            0, table['complexity'] / site.complexCredits - 1)
+      self.evaluations += len(batch)
+      return table['score'], violation, table
+
+   # True where design a is at least as good as design b
+   @staticmethod
+   def Better(scoreA, violationA, scoreB, violationB):
+      return np.where((violationA == 0) & (violationB == 0),
+                      scoreA >= scoreB, violationA <= violationB)
+
+   # Run the optimisation and return the best design as a Detector. Its
+   # result table row is kept in self.best.
+   def Run(self, generations=100, population=None):
+      size = self.populationSize
+      dims = len(self.lower)
+      if population is None:
+         population = self.lower + self.rng.random(
+            (size, dims)) * (self.upper - self.lower)
+      x = np.array(population, dtype=float)
+      size = len(x)
+      score, violation, table = self.Evaluate(x)
+      for generation in range(generations):
+         # Three distinct partners per design, all different from it
+         partners = np.argsort(self.rng.random((size, size - 1)), axis=1)[:, :3]
+         partners += partners >= np.arange(size)[:, np.newaxis]
+         a, b, c = partners.T
+         mutant = x[a] + self.mutation * (x[b] - x[c])
+         cross = self.rng.random((size, dims)) < self.crossover
+         cross[np.arange(size), self.rng.integers(dims, size=size)] = True
+         trial = np.clip(np.where(cross, mutant, x), self.lower, self.upper)
+         trialScore, trialViolation, trialTable = self.Evaluate(trial)
+         better = self.Better(trialScore, trialViolation, score, violation)
+         x[better] = trial[better]
+         score = np.where(better, trialScore, score)
+         violation = np.where(better, trialViolation, violation)
+         for key in table:
+            table[key] = np.where(better, trialTable[key], table[key])
+         self.history.append(np.max(np.where(violation == 0, score, -np.inf)))
+
+      feasible = violation == 0
+      if np.any(feasible):
+         i = np.argmax(np.where(feasible, score, -np.inf))
+      else:
+         i = np.argmin(violation)
+      self.best = {key: table[key][i] for key in table}
+      columns = self.Decode(x[i:i + 1])
+      return DetectorBatch(columns, self.freqrange).GetDetector(0)
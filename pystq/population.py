@@ -0,0 +1,58 @@
+import numpy as np
+from pystq import materials, sites
+from pystq.detector import Detector, DetectorBatch
+
+
+# Sampling methods of RandomPopulation
+methods = ['uniform', 'lhs', 'sobol']
+
+
+# n points in the unit hypercube of the given dimension, drawn with rng.
+# 'uniform' draws every coordinate independently, 'lhs' (Latin hypercube)
+# places exactly one point in each of n equal slices of every coordinate,
+# and 'sobol' takes a scrambled Sobol sequence, which is best balanced for
+# n a power of 2.
+def UnitSamples(rng, n, dimension, method='uniform'):
+   if method == 'uniform':
+      return rng.random((n, dimension))
+   if method == 'lhs':
+      slices = np.argsort(rng.random((dimension, n)), axis=1).T
+      return (slices + rng.random((n, dimension))) / n
+   if method == 'sobol':
+      # SciPy is only loaded for Sobol sampling
+      from scipy.stats import qmc
+      return qmc.Sobol(dimension, scramble=True, seed=rng).random(n)
+   raise ValueError('Unknown sampling method: {}, use one of {}'.format(
+      method, ', '.join(methods)))
+
+
+# Batch of n random designs within Detector.limits. Keys with integer limits
+# take every integer from low to high with equal probability. site and
+# material are drawn from all options unless given as a class, option name
+# or index; fixed holds other parameters that are not drawn. seed may be a
+# number or a numpy Generator, so that the same seed gives the same designs.
+def RandomPopulation(n, method='uniform', seed=None, site=None, material=None,
+                     fixed={}, freqrange=(0, 4)):
+   rng = np.random.default_rng(seed)
+   keys = [key for key in Detector.limits
+           if key != 'freqrange' and key not in fixed]
+   categories = [(key, classes) for key, value, classes in
+                 (('site', site, sites.allSites),
+                  ('material', material, materials.allMaterials))
+                 if value is None]
+   u = UnitSamples(rng, n, len(keys) + len(categories), method)
+
+   columns = {key: np.full(n, fixed[key], dtype=float) for key in fixed}
+   for i, key in enumerate(keys):
+      low, high = Detector.limits[key]
+      if type(low) is int and type(high) is int:
+         columns[key] = np.minimum(
+            np.floor(low + u[:, i] * (high - low + 1)), high)
+      else:
+         columns[key] = low + u[:, i] * (high - low)
+   columns['site'] = site
+   columns['material'] = material
+   for i, (key, classes) in enumerate(categories, len(keys)):
+      columns[key] = np.minimum(np.floor(u[:, i] * len(classes)),
+                                len(classes) - 1).astype(int)
+   return DetectorBatch(columns, freqrange)
@@ -0,0 +1,64 @@
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+# Timings collected by a ScoreCalculator with profiling switched on (see
+# ScoreCalculator.SetProfiling). Times are wall-clock seconds, and the time
+# of a section includes the sections and noise models run within it.
+class ScoreStats:
+
+   def __init__(self):
+      self.Reset()
+
+   def Reset(self):
+      # Per noise model: evaluations over a grid, calls of ComputePoint,
+      # seconds and points (frequencies times configurations) evaluated
+      self.models = {}
+      # Per section: calls and seconds
+      self.sections = {}
+      # Times each grid of (frequencies, configurations) was evaluated
+      self.grids = Counter()
+
+   @contextmanager
+   def Section(self, name):
+      start = time.perf_counter()
+      try:
+         yield
+      finally:
+         calls, seconds = self.sections.get(name, (0, 0.0))
+         self.sections[name] = (calls + 1,
+                                seconds + time.perf_counter() - start)
+
+   def AddModel(self, name, seconds, computeCalls, points):
+      evaluations, calls, total, allPoints = self.models.get(
+         name, (0, 0, 0.0, 0))
+      self.models[name] = (evaluations + 1, calls + computeCalls,
+                           total + seconds, allPoints + points)
+
+   def AddGrid(self, frequencies, configurations):
+      self.grids[(frequencies, configurations)] += 1
+
+   # Plain text table of the statistics, slowest noise models first
+   def Report(self):
+      lines = ['{:<24}{:>8}{:>10}{:>12}{:>12}'.format(
+         'Noise model', 'evals', 'calls', 'time [ms]', 'us/point')]
+      for name in sorted(self.models, key=lambda n: -self.models[n][2]):
+         evaluations, calls, seconds, points = self.models[name]
+         lines.append('{:<24}{:>8}{:>10}{:>12.3f}{:>12.4f}'.format(
+            name[:23], evaluations, calls, seconds * 1E3,
+            seconds * 1E6 / max(points, 1)))
+      lines.append('')
+      lines.append('{:<24}{:>8}{:>22}'.format('Section', 'calls',
+                                              'time [ms]'))
+      for name in sorted(self.sections,
+                         key=lambda n: -self.sections[n][1]):
+         calls, seconds = self.sections[name]
+         lines.append('{:<24}{:>8}{:>22.3f}'.format(name[:23], calls,
+                                                    seconds * 1E3))
+      lines.append('')
+      lines.append('{:<24}{:>8}'.format('Grid (f x configs)', 'uses'))
+      for (frequencies, configurations), uses in sorted(self.grids.items()):
+         lines.append('{:<24}{:>8}'.format(
+            '{} x {}'.format(frequencies, configurations), uses))
+      return '\n'.join(lines)
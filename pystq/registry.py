@@ -0,0 +1,99 @@
+import numpy as np
+from pystq.noise import *
+
+
+# Capabilities a noise model can declare as attributes, with the values
+# assumed for models that do not declare them:
+#   vectorized            ComputePoint takes arrays of frequencies and the
+#                         columns of a DetectorBatch (None if unknown)
+#   dependencies          keys of detector.parameters it reads (None if
+#                         unknown, so its curve is never cached)
+#   frequencyIndependent  the noise is the same at every frequency, so it
+#                         is evaluated once and broadcast
+defaultCapabilities = {'vectorized': None,
+                       'dependencies': None,
+                       'frequencyIndependent': False}
+
+
+def Capabilities(model):
+   return {key: getattr(model, key, defaultCapabilities[key])
+           for key in defaultCapabilities}
+
+
+# Wraps a noise model that is not known to take arrays so that it can be
+# evaluated like a vectorized one, including on a DetectorBatch. Array calls
+# are tried first unless the model declares vectorized = False; when they
+# fail the model is evaluated point by point, and for batches configuration
+# by configuration, which is remembered for later calls.
+class WrappedNoise:
+   vectorized = True
+
+   def __init__(self, model):
+      self.model = model
+      # Calls of the ComputePoint of the model so far
+      self.calls = 0
+      self.dependencies = getattr(model, 'dependencies', None)
+      self.frequencyIndependent = getattr(model, 'frequencyIndependent',
+                                          False)
+      # Whether array calls work, for single detectors (False) and for
+      # batches (True)
+      vectorized = getattr(model, 'vectorized', None)
+      if vectorized is None:
+         self.arrayCapable = {}
+      else:
+         self.arrayCapable = {False: vectorized, True: vectorized}
+
+   def ComputePoint(self, f, detector):
+      batch = detector.shape != ()
+      shape = np.broadcast_shapes(np.shape(f), detector.shape)
+      if self.arrayCapable.get(batch, True):
+         try:
+            self.calls += 1
+            value = np.asarray(self.model.ComputePoint(f, detector),
+                               dtype=float)
+            value = np.broadcast_to(value, shape)
+            self.arrayCapable[batch] = True
+            return value
+         except (TypeError, ValueError):
+            self.arrayCapable[batch] = False
+      return self.ComputeEach(f, detector)
+
+   def ComputeEach(self, f, detector):
+      if detector.shape == ():
+         configurations = [detector]
+      else:
+         configurations = [detector.GetDetector(i)
+                           for i in range(len(detector))]
+      # Frequencies come as a column when the detector is a batch
+      fShape = np.shape(f)[:max(np.ndim(f) - len(detector.shape), 0)]
+      self.calls += np.size(f) * len(configurations)
+      value = np.array([[self.model.ComputePoint(fi, configuration)
+                         for configuration in configurations]
+                        for fi in np.ravel(f)], dtype=float)
+      return value.reshape(fShape + detector.shape)
+
+
+# Model to place in ScoreCalculator.noiseModels: vectorized models are used
+# as they are, anything else is wrapped
+def PrepareNoiseModel(model):
+   if getattr(model, 'vectorized', None) is True:
+      return model
+   return WrappedNoise(model)
+
+
+# Noise models included in every ScoreCalculator, by name, in the order
+# they are listed
+noiseRegistry = {}
+
+
+def RegisterNoise(name, model):
+   noiseRegistry[name] = PrepareNoiseModel(model)
+
+
+RegisterNoise('Residual Gas', ResidualGas())
+RegisterNoise('Mirror Thermal', MirrorThermalNoise())
+RegisterNoise('Radiation Pressure', RadiationPressureNoise())
+RegisterNoise('Seismic', SeismicNoise())
+RegisterNoise('Shot', ShotNoise())
+RegisterNoise('Gravity Gradient', GravityGradientNoise())
+RegisterNoise('Suspension Thermal', SuspThermalNoise())
@@ -1,9 +1,14 @@
+import time
+from contextlib import nullcontext
+
 import numpy as np
 import pystq.constants as constants
 import pystq.utils as utils
+from pystq.cache import ModelIdentity, cacheVersion
 from pystq.noise import *
+from pystq.profiling import ScoreStats
+from pystq.registry import Capabilities, PrepareNoiseModel, noiseRegistry
 from pystq.materials import GetRoughnessLoss
-import scipy.integrate as integrate
 
 
 def CalcComplex(detector):
@@ -13,13 +18,13 @@ def CalcComplex(detector):
                                   detector.parameters['depth'])
    vacuumComplex = detector.parameters['pumps'] / 10
 
-   if detector.parameters['temperature'] > constants.nitrogenTemp:
-      coolingComplex = 1 - (detector.parameters['temperature'] - constants.nitrogenTemp)/\
+   coolingComplex = np.where(
+      detector.parameters['temperature'] > constants.nitrogenTemp,
+      1 - (detector.parameters['temperature'] - constants.nitrogenTemp)/\
       (detector.constants['initAmbientTemp'] +
               detector.constants['tempIncPerKm'] * detector.parameters['depth'] /\
-               1000 - constants.nitrogenTemp)
-   else:
-      coolingComplex = 5
+               1000 - constants.nitrogenTemp),
+      5)
 
    # Vibration
    stagesComplex = detector.parameters['sus_stages'] / 2
@@ -36,21 +41,24 @@ def CalcComplex(detector):
 
 def CalcCost(detector):
    # Environment
-   depthCosts = np.power(max(
+   depthCosts = np.power(np.maximum(
       (detector.parameters['depth'] - 20), 0), 1 / 3) * 75E5
    vacuumCosts = detector.parameters['pumps'] * detector.constants[
       'vacuumPumpCost']
-   if detector.parameters['temperature'] > constants.nitrogenTemp:
-      K0 = 0
-      K1 = 20102
-      K2 = detector.constants['initAmbientTemp'] + \
-      detector.constants['tempIncPerKm'] * detector.parameters['depth'] / 1000
-      coolingCosts = K0 + K1 * (K2 - detector.parameters['temperature'])
-   else:
-      K2 = 77
-      K1 = 10201
-      K0 = 7000000
-      coolingCosts = K0 + K1 * (K2 - detector.parameters['temperature'])**2
+   # Above nitrogen temperature
+   K0 = 0
+   K1 = 20102
+   K2 = detector.constants['initAmbientTemp'] + \
+   detector.constants['tempIncPerKm'] * detector.parameters['depth'] / 1000
+   warmCosts = K0 + K1 * (K2 - detector.parameters['temperature'])
+   # Cryogenic
+   K2 = 77
+   K1 = 10201
+   K0 = 7000000
+   coldCosts = K0 + K1 * (K2 - detector.parameters['temperature'])**2
+   coolingCosts = np.where(
+      detector.parameters['temperature'] > constants.nitrogenTemp,
+      warmCosts, coldCosts)
 
    # Vibration
    vibrationCosts = (detector.parameters['sus_length']**2.1 * detector.
@@ -69,6 +77,120 @@ def CalcCost(detector):
            powerCosts + matCosts + roughnessCosts)
 
 
+# Terms of the horizon distance of a binary with masses m1 and m2 (in solar
+# masses): the frequency up to which the sensitivity is integrated, and the
+# constant the integral is multiplied with. m1 and m2 may be arrays.
+def GetBinaryTerms(m1, m2):
+   snr_threshold = 8
+
+   nu_Msun = constants.Msun * constants.G / (constants.c)**3
+
+   # Note: This function assumes natural units where G == c == 1. For
+   # this reason Mpc and Msun are converted to seconds.
+   # Keplerian orbital frequency at the innermost stable circular orbit.
+   # At this point the GW signal shuts off (for BNS) or transitions into
+   # merger and ringdown (NSBH & BBH)
+   # [Ref 2, page 7, between equations 2.21 and 2.22]
+   f_isco = 1 / (np.power(6, 1.5) * np.pi * (m1 + m2) * nu_Msun)
+   # Chirp mass: (m1*m2)**(3/5) / (m1+m2)**(1/5)
+   m_chirp = (np.power(m1 * m2, 0.6) / np.power(m1 + m2, 0.2)) * nu_Msun
+   # Constant containing all components of 3.16 except f_{7/3}, where
+   # the equation has been solved for d_L and the SNR threshold of
+   # 8 is used as SNR value. A is defined in Ref 1, equation 3.30.
+   # 16 is the maximum value of $\Theta^2$ [Page 10, after equation 3.31]
+   # which corresponds to the loudest possible signal.
+   tmp = 5 * np.power(m_chirp, 5/3) * 16 / (96 * np.power(np.pi, 4/3) * \
+         np.power(snr_threshold, 2))
+   return f_isco, tmp
+
+
+# Horizon distance in Mpc from the integral over 1/(f**(7/3)*S_n(f))
+def DistanceFromIntegral(tmp, freq73):
+   nu_Mpc = constants.Distances['MPC'] / constants.c
+   # Combining the terms and converting the result into physical units.
+   return np.sqrt(tmp * freq73) / nu_Mpc / 2.26
+
+
+# Integrands of the science run for the total PSD on the frequencies f,
+# stacked along a leading axis: f^(-7/3)/S_n(f) of the horizon distance
+# [Ref 1, page 8, equation 3.18], and the excess of sqrt(S_n + (1E-23)^2)
+# over sqrt(S_n) for supernovae. The excess is written as one term so that
+# the small difference is not lost to round-off.
+def ScienceIntegrands(f, psd):
+   signal = np.power(1E-23, 2)
+   return np.stack([np.power(f, -7 / 3) / psd,
+                    signal / (np.sqrt(psd + signal) + np.sqrt(psd))])
+
+
+# Supernova detection from the integrated excess noise
+def SupernovaFromExcess(excess):
+   return np.where((np.power(excess / 4E-20, 3) * 25) >= 1, 1, 0)[()]
+
+
+# Evaluate a noise model over a whole array of frequencies in a single call.
+# Models that are not declared vectorized are wrapped (see registry.py), so
+# scalar-only models are evaluated point by point, and frequency independent
+# models are evaluated at a single frequency.
+# For a DetectorBatch the result has shape (configurations, frequencies).
+def EvaluateNoiseModel(model, f, detector):
+   capabilities = Capabilities(model)
+   if not capabilities['vectorized']:
+      model = PrepareNoiseModel(model)
+   fDims = np.ndim(f)
+   dDims = len(detector.shape)
+   shape = np.shape(f) + detector.shape
+   if capabilities['frequencyIndependent']:
+      value = np.asarray(model.ComputePoint(np.ravel(f)[0], detector),
+                         dtype=float)
+      value = np.broadcast_to(value, detector.shape)
+      return np.broadcast_to(value.reshape(detector.shape + (1,) * fDims),
+                             detector.shape + np.shape(f))
+   # Frequencies run along the leading axes while they pass through the
+   # model, so that the per-configuration columns broadcast against them
+   fColumn = np.reshape(f, np.shape(f) + (1,) * dDims)
+   value = np.asarray(model.ComputePoint(fColumn, detector), dtype=float)
+   value = np.broadcast_to(value, shape)
+   return np.moveaxis(value, list(range(fDims)),
+                      list(range(dDims, dDims + fDims)))
+
+
+# Hashable state of the constants of a detector, to notice changes to them
+def ConstantsState(constants):
+   return tuple((key, value.tobytes() if isinstance(value, np.ndarray)
+                 else value) for key, value in constants.items())
+
+
+# Fields of Score, in the column order used for tables of results
+scoreFields = ['score', 'nsnsRange', 'bhbhRange', 'nsns', 'bhbh',
+               'supernovae', 'nsnsMissed', 'bhbhMissed', 'supernovaeMissed']
+# Fields of Score that hold integers
+intScoreFields = ['supernovae', 'nsnsMissed', 'bhbhMissed', 'supernovaeMissed']
+# Fields of Score that hold whole numbers, kept as floats for a DetectorBatch
+countScoreFields = ['nsns', 'bhbh']
+
+
+# A whole number of a single detector as an int. Arrays of a DetectorBatch
+# are returned as they are.
+def WholeNumber(values):
+   return int(values) if np.ndim(values) == 0 else values
+
+
+# Score of a single detector as an array of scoreFields, and back
+def ScoreToArray(score):
+   return np.array([getattr(score, field) for field in scoreFields],
+                   dtype=float)
+
+
+def ScoreFromArray(values):
+   score = Score()
+   for field, value in zip(scoreFields, values):
+      if field in intScoreFields or field in countScoreFields:
+         setattr(score, field, int(value))
+      else:
+         setattr(score, field, np.float64(value))
+   return score
+
+
 class Score:
 
    def __init__(self):
@@ -92,160 +214,327 @@ class ScoreCalculator:
       # workaround for Bokeh bug, see widget.py
       self.nData = 1000
 
-      # Dictionary containing noise models
-      self.noiseModels = {}
-      self.noiseModels['Residual Gas'] = ResidualGas()
-      self.noiseModels['Mirror Thermal'] = MirrorThermalNoise()
-      self.noiseModels['Radiation Pressure'] = RadiationPressureNoise()
-      self.noiseModels['Seismic'] = SeismicNoise()
-      self.noiseModels['Shot'] = ShotNoise()
-      self.noiseModels['Gravity Gradient'] = GravityGradientNoise()
-      self.noiseModels['Suspension Thermal'] = SuspThermalNoise()
+      # Dictionary containing noise models, starting from the registered
+      # ones
+      self.noiseModels = dict(noiseRegistry)
       # And another one dictating which we actually use in calculations
-      self.noisesUsed = {}
-      self.noisesUsed['Residual Gas'] = True
-      self.noisesUsed['Mirror Thermal'] = True
-      self.noisesUsed['Radiation Pressure'] = True
-      self.noisesUsed['Seismic'] = True
-      self.noisesUsed['Shot'] = True
-      self.noisesUsed['Gravity Gradient'] = True
-      self.noisesUsed['Suspension Thermal'] = True
+      self.noisesUsed = {key: True for key in self.noiseModels}
+      # Integration over frequency: nData log-spaced points, or sampling
+      # adapted to the integrand until the integrals agree to within the
+      # relative tolerance (see SetIntegration)
+      self.adaptive = False
+      self.tolerance = 1E-6
+      # Frequencies at which the PSD was evaluated by the last integral
+      self.evaluations = 0
+      # Noise curves from the last evaluation, with the state they were
+      # computed for, so that only invalidated curves are recomputed
+      self.curveCache = {}
+      # Optional ResultCache holding scores and noise curves of designs
+      # evaluated before, also by other sessions (see SetResultCache)
+      self.resultCache = None
+      self.cacheKeys = {}
+      # ScoreStats of the calculations while profiling is switched on
+      self.stats = None
+      # Number of configurations of a DetectorBatch whose noise curves the
+      # fixed grid integration keeps in keptCurves, in the form returned by
+      # GetNoiseArrays. Curves are only kept when the integration grid is
+      # that of GetNoiseArrays.
+      self.keepCurves = 0
+      self.keptCurves = None
 
    # Setter for frequency range
    def SetFreqRange(self, fLo, fHi):
       self.fMin = pow(10, fLo)
       self.fMax = pow(10, fHi)
 
+   # Calculator for detector with the frequency range given in log10(Hz),
+   # and noiseModels and noisesUsed passed on to SetNoiseModels and
+   # SetNoiseUsed
+   @classmethod
+   def Configured(cls, detector, freqrange, noiseModels={}, noisesUsed={}):
+      calculator = cls(detector)
+      calculator.SetFreqRange(*freqrange)
+      calculator.SetNoiseModels(noiseModels)
+      for key in noisesUsed:
+         calculator.SetNoiseUsed(key, noisesUsed[key])
+      return calculator
+
+   # Setter for the integration mode and its relative tolerance
+   def SetIntegration(self, adaptive, tolerance=1E-6):
+      self.adaptive = adaptive
+      self.tolerance = tolerance
+
+   # Whether integrals are refined adaptively. A batch is refined wherever
+   # any of its configurations needs it, evaluating every configuration at
+   # every refined point, so batches use the fixed grid of nData points.
+   def Adaptive(self):
+      return self.adaptive and self.detector.shape == ()
+
+   # Setter for the on-disk cache of results, a cache.ResultCache or None
+   def SetResultCache(self, resultCache):
+      self.resultCache = resultCache
+
+   # Switch the collection of timings in self.stats on or off. Switching it
+   # on again starts new statistics.
+   def SetProfiling(self, profiling):
+      self.stats = ScoreStats() if profiling else None
+
+   # Context in which the time spent is added to the section name of
+   # self.stats, if profiling
+   def Profile(self, name):
+      if self.stats is None:
+         return nullcontext()
+      return self.stats.Section(name)
+
+   # Evaluate the noise model key on the frequencies f, recording its time
+   # and calls of ComputePoint if profiling
+   def EvaluateNoise(self, key, f):
+      model = self.noiseModels[key]
+      if self.stats is None:
+         return EvaluateNoiseModel(model, f, self.detector)
+      calls = getattr(model, 'calls', None)
+      start = time.perf_counter()
+      curve = EvaluateNoiseModel(model, f, self.detector)
+      seconds = time.perf_counter() - start
+      calls = 1 if calls is None else model.calls - calls
+      self.stats.AddModel(key, seconds, calls, np.size(curve))
+      return curve
+
    # Setter for True/False values of noisesUsed
    def SetNoiseUsed(self, key, valueTF):
       self.noisesUsed[key] = valueTF
 
    # Function to assign a new noise model to a key in noiseModels.
    # Can be used both to overwrite existing models, and to add new ones.
+   # Models that are not declared vectorized are wrapped so that they can
+   # still be evaluated over arrays of frequencies and batches.
    def SetNoiseModels(self, newNoiseDict):
       for key in newNoiseDict:
-         self.noiseModels[key] = newNoiseDict[key]
+         self.noiseModels[key] = PrepareNoiseModel(newNoiseDict[key])
          self.SetNoiseUsed(key, True)
 
    def GetDetectorDistance(self, m1, m2):
-      snr_threshold = 8
-
-      nu_Mpc = constants.Distances['MPC'] / constants.c
-      nu_Msun = constants.Msun * constants.G / (constants.c)**3
-
-      # Note: This function assumes natural units where G == c == 1. For
-      # this reason Mpc and Msun are converted to seconds above.
-      # Keplerian orbital frequency at the innermost stable circular orbit.
-      # At this point the GW signal shuts off (for BNS) or transitions into
-      # merger and ringdown (NSBH & BBH)
-      # [Ref 2, page 7, between equations 2.21 and 2.22]
-      f_isco = 1 / (np.power(6, 1.5) * np.pi * (m1 + m2) * nu_Msun)
-      # Chirp mass: (m1*m2)**(3/5) / (m1+m2)**(1/5)
-      m_chirp = (np.power(m1 * m2, 0.6) / np.power(m1 + m2, 0.2)) * nu_Msun
-      # Constant containing all components of 3.16 except f_{7/3}, where
-      # the equation has been solved for d_L and the SNR threshold of
-      # 8 is used as SNR value. A is defined in Ref 1, equation 3.30.
-      # 16 is the maximum value of $\Theta^2$ [Page 10, after equation 3.31]
-      # which corresponds to the loudest possible signal.
-      tmp = 5 * np.power(m_chirp, 5/3) * 16 / (96 * np.power(np.pi, 4/3) * \
-            np.power(snr_threshold, 2))
-      # Mask used to integrate only the range from f_low to f_isco
-      #criterion = (freq > f_low)*(freq < f_isco)
-      #assert f_low >= min(freq)
-      #assert f_isco <= max(freq)
+      return self.GetDetectorDistances(m1, m2)
+
+   # Horizon distances (Mpc) for arrays of masses m1 and m2 (in solar
+   # masses), with shape detector.shape + the broadcast shape of the masses.
+   # The sensitivity integral is accumulated once over a range reaching the
+   # highest ISCO frequency and read off at the f_isco of every pair.
+   def GetDetectorDistances(self, m1, m2):
+      f_isco, tmp = GetBinaryTerms(np.asarray(m1, dtype=float),
+                                   np.asarray(m2, dtype=float))
       # Integral over 1/(f**(7/3)*S_n(f)) [Ref 1, page 8, equation 3.18]
       # Note the '**2' used on noiseamp: be careful whether noiseamp
       # is the ASD or PSD. The current code is checked against the
       # observing scenarios paper.
-      freq73 = self.CalcSensitivityIntegral(self.fMin, f_isco)
-      # Combining the terms and converting the result into physical units.
-      return np.sqrt(tmp * freq73) / nu_Mpc / 2.26
-
-   def SensitivityLine(self, f):
-      usedNoises = []
-      for key in self.noisesUsed:
-         if self.noisesUsed[key]:
-            usedNoises.append(self.noiseModels[key])
-      return sum(
-         [model.ComputePoint(f, self.detector)**2 for model in usedNoises])
+      freq73 = self.ScienceIntegral(f_isco)(f_isco)[0]
+      return DistanceFromIntegral(tmp, freq73)[()]
+
+   # Keys of the noise models that are switched on, in noiseModels order
+   def UsedNoises(self):
+      return [key for key in self.noiseModels if self.noisesUsed[key]]
+
+   # Total PSD at f. The curves of the first keep configurations of a
+   # DetectorBatch are kept in keptCurves.
+   def SensitivityLine(self, f, keep=0):
+      with self.Profile('SensitivityLine'):
+         if self.stats is not None:
+            self.stats.AddGrid(np.size(f), int(np.prod(self.detector.shape)))
+         names = self.UsedNoises()
+         total = np.zeros(self.detector.shape + np.shape(f))
+         kept = []
+         for key in names:
+            curve = self.EvaluateNoise(key, f)
+            total += curve**2
+            if keep > 0:
+               kept.append(np.broadcast_to(curve, total.shape)[:keep])
+         if keep > 0:
+            self.keptCurves = (f, np.array(kept).reshape(
+               (len(names), keep, np.size(f))), np.sqrt(total[:keep]), names)
+      return total
 
    def CalcSensitivityIntegral(self, f_1, f_2):
 
       def y_func(freq):
          return np.power(freq, -7 / 3) / self.SensitivityLine(freq)
 
-      f_1 = np.log10(f_1)
-      f_2 = np.log10(f_2)
-
+      with self.Profile('Integration'):
+         if self.Adaptive():
+            integral = utils.AdaptiveIntegral(y_func, f_1, f_2,
+                                              self.tolerance)
+            self.evaluations = integral.evaluations
+            return integral(f_2)
+
+         f_1 = np.log10(f_1)
+         f_2 = np.log10(f_2)
+
+         f = np.logspace(f_1, f_2, num=self.nData)
+         self.evaluations = self.nData
+         return utils.CumulativeIntegral(f, y_func(f))(f[-1])
+
+   # State of the inputs of a noise model on the current grid, including the
+   # detector constants, or None if it cannot be tracked. A model without
+   # 'dependencies' reads the whole detector, and batches are not cached.
+   def NoiseState(self, key):
+      model = self.noiseModels[key]
+      dependencies = getattr(model, 'dependencies', None)
+      if dependencies is None or self.detector.shape != ():
+         return None
+      return (model, self.fMin, self.fMax, self.nData,
+              [self.detector.parameters[dep] for dep in dependencies],
+              ConstantsState(self.detector.constants))
+
+   # Noise curve of a single model on the grid f, taken from the cache when
+   # none of the parameters it depends on have changed
+   def GetNoiseCurve(self, key, f):
+      state = self.NoiseState(key)
+      if state is not None and key in self.curveCache:
+         cachedState, curve = self.curveCache[key]
+         if cachedState[0] is state[0] and cachedState[1:] == state[1:]:
+            return curve
+      curve = self.EvaluateNoise(key, f)
+      if state is not None:
+         self.curveCache[key] = (state, curve)
+      return curve
+
+   # Evaluate every enabled noise model exactly once over the whole frequency
+   # grid. Returns the frequencies, a (models x frequencies) matrix of noise
+   # amplitudes, the total noise and the model names in row order. For a
+   # DetectorBatch the matrix is (models x configurations x frequencies).
+   def GetNoiseArrays(self):
+      names = self.UsedNoises()
+      f_1 = np.log10(self.fMin)
+      f_2 = np.log10(self.fMax)
       f = np.logspace(f_1, f_2, num=self.nData)
-      y = y_func(f)
-
-      I = integrate.simps(y, f)
-
-      return I
+      curves = np.empty((len(names),) + self.detector.shape + (self.nData,))
+      with self.Profile('GetNoiseCurves'):
+         if self.stats is not None:
+            self.stats.AddGrid(self.nData, int(np.prod(self.detector.shape)))
+         for i, key in enumerate(names):
+            curves[i] = self.GetNoiseCurve(key, f)
+      # Summing the squared rows swaps the contributions of recomputed curves
+      # into the total without the round-off of adding and subtracting them
+      total = np.sqrt(np.einsum('i...,i...->...', curves, curves))
+      return f, curves, total, names
+
+   # Key under which results of the given kind are kept in resultCache, or
+   # None when they are not cached. Only single detectors are cached.
+   # Making the key canonical takes far longer than looking it up, so keys
+   # are remembered for the exact state they were made for.
+   def CacheKey(self, kind):
+      if self.resultCache is None or self.detector.shape != ():
+         return None
+      models = [self.noiseModels[key] for key in self.UsedNoises()]
+      parameters = self.detector.parameters
+      if getattr(parameters, 'extra', True):
+         parameters = tuple(parameters.items())
+      else:
+         parameters = parameters.record.tobytes()
+      # Models whose methods are replaced get a new key
+      code = [getattr(getattr(model, 'model', model), 'ComputePoint', None)
+              for model in models]
+      code = [getattr(function, '__code__', None) for function in code]
+      state = (kind, parameters, ConstantsState(self.detector.constants),
+               self.fMin, self.fMax, self.nData, self.adaptive,
+               self.tolerance, tuple(map(id, models)), tuple(map(id, code)))
+      if state in self.cacheKeys:
+         return self.cacheKeys[state][1]
+      key = self.resultCache.Key(
+         kind, cacheVersion, self.detector.parameters,
+         self.detector.constants, self.fMin, self.fMax,
+         self.nData, self.adaptive, self.tolerance,
+         [(key, ModelIdentity(model))
+          for key, model in zip(self.UsedNoises(), models)])
+      if len(self.cacheKeys) >= 1024:
+         self.cacheKeys.clear()
+      # The models and code are kept with the key so that their ids stay
+      # unique
+      self.cacheKeys[state] = ((models, code), key)
+      return key
 
    # Function to compute and return individual noise, plus total noise.
    def GetNoiseCurves(self):
+      key = self.CacheKey('curves')
+      if key is not None:
+         rows = self.resultCache.Get(key)
+         if rows is not None:
+            return rows[0], list(rows[1:]), self.UsedNoises() + ['Total']
 
-      curves = {}
-      for key in self.noiseModels:
-         if self.noisesUsed[key]:
-            curves[key] = []
-      total = []
-      f_out = []
-      f_1 = np.log10(self.fMin)
-      f_2 = np.log10(self.fMax)
-      f_range = np.logspace(f_1, f_2, num=self.nData)
-      for f in f_range[0:self.nData]:
-
-         f_out.append(f)
-         for key in curves:
-            curves[key].append(self.noiseModels[key].ComputePoint(
-               f, self.detector))
-         total.append(np.sqrt(self.SensitivityLine(f)))
+      f, curves, total, names = self.GetNoiseArrays()
       # Ensure that total is placed last on any list
-      curveList = [curves[key] for key in curves]
+      curveList = list(curves)
       curveList.append(total)
-      nameList = [key for key in curves]
-      nameList.append('Total')
-      return f_out, curveList, nameList
-
-   def Supernovae(self):
+      nameList = names + ['Total']
+      if key is not None:
+         self.resultCache.Put(key, np.vstack([f] + curveList))
+      return f, curveList, nameList
+
+   # Running integrals of the ScienceIntegrands from fMin up to fMax, or up
+   # to the highest of the frequencies points if that is higher, from a
+   # single evaluation of the total PSD. Calling the result with frequencies
+   # returns the integrals up to them, stacked as in ScienceIntegrands; the
+   # adaptive integral is most accurate at fMax and the points.
+   def ScienceIntegral(self, points=()):
 
-      f_1 = np.log10(self.fMin)
-      f_2 = np.log10(self.fMax)
-
-      def yn_func(freq):
-         return np.sqrt(self.SensitivityLine(freq))
-
-      def ys_func(freq):
-         return np.sqrt(self.SensitivityLine(freq) + np.power(1E-23, 2))
-
-      f = np.logspace(f_1, f_2, num=self.nData)
-      yn = yn_func(f)
-      ys = ys_func(f)
-
-      In = integrate.simps(yn, f)
-
-      Is = integrate.simps(ys, f)
-
-      excess = max(0, Is - In)
+      def y_func(freq):
+         return ScienceIntegrands(freq, self.SensitivityLine(freq))
+
+      points = np.append(np.ravel(points), self.fMax)
+      fHi = np.max(points)
+      with self.Profile('Integration'):
+         if self.Adaptive():
+            integral = utils.AdaptiveIntegral(y_func, self.fMin, fHi,
+                                              self.tolerance, points=points)
+            self.evaluations = integral.evaluations
+            return integral
+
+         f = np.logspace(np.log10(self.fMin), np.log10(fHi), num=self.nData)
+         self.evaluations = self.nData
+         keep = self.keepCurves if fHi == self.fMax and \
+            self.detector.shape != () else 0
+         return utils.CumulativeIntegral(
+            f, ScienceIntegrands(f, self.SensitivityLine(f, keep)))
 
-      if (np.power(excess / 4E-20, 3) * 25) >= 1:
-         return 1
-      else:
-         return 0
+   def Supernovae(self):
+      return SupernovaFromExcess(self.ScienceIntegral()(self.fMax)[1])
 
    def CalcNumNSNS(self, R):
-      return (round(4 / 3 * np.pi * np.power(R / 1E3, 3) * 6000 * 1 / 12))
+      return WholeNumber(
+         np.round(4 / 3 * np.pi * np.power(R / 1E3, 3) * 6000 * 1 / 12))
 
    def CalcNumBHBH(self, R):
-      return (round(4 / 3 * np.pi * np.power(R / 1E3, 3) * 20 * 1 / 12))
+      return WholeNumber(
+         np.round(4 / 3 * np.pi * np.power(R / 1E3, 3) * 20 * 1 / 12))
 
    def CalcScore(self):
+      key = self.CacheKey('score')
+      if key is not None:
+         values = self.resultCache.Get(key)
+         if values is not None:
+            return ScoreFromArray(values)
+      score = self.ComputeScore()
+      if key is not None:
+         self.resultCache.Put(key, ScoreToArray(score))
+      return score
+
+   def ComputeScore(self):
+      with self.Profile('CalcScore'):
+         return self.ScoreFromRanges(*self.ScienceRanges())
+
+   # Horizon distances of the NS-NS and BH-BH binaries and the integrated
+   # supernova excess noise. The total PSD is evaluated once, and every
+   # integral is read off the same running integrals.
+   def ScienceRanges(self):
+      f_isco, tmp = GetBinaryTerms(np.array([1.7, 47]), np.array([1.7, 47]))
+      integral = self.ScienceIntegral(f_isco)
+      ranges = DistanceFromIntegral(tmp, integral(f_isco)[0])
+      return ranges[..., 0], ranges[..., 1], integral(self.fMax)[1]
+
+   # Score of the detector from the results of ScienceRanges
+   def ScoreFromRanges(self, nsnsRange, bhbhRange, excess):
       score = Score()
-      score.nsnsRange = self.GetDetectorDistance(1.7, 1.7)
-      score.bhbhRange = self.GetDetectorDistance(47, 47)
+      score.nsnsRange = np.asarray(nsnsRange)[()]
+      score.bhbhRange = np.asarray(bhbhRange)[()]
 
       # Number of detections, we aribitrarily assume a run length of 1/200 year
       # 1) BNS,  we pick (randonmly) a rate of 6000 Gpc^-3 yr^-1
@@ -257,18 +546,45 @@ class ScoreCalculator:
       score.bhbh = self.CalcNumBHBH(score.bhbhRange)
 
       # 3) self made SN number
-      score.supernovae = self.Supernovae()
+      score.supernovae = WholeNumber(SupernovaFromExcess(excess))
 
       # Weighted score distance
       score.score = np.sqrt(score.nsnsRange**2 + (score.bhbhRange / 10)**2)
 
       # Missed sources
-      overComplex = max(0,
-                        CalcComplex(self.detector) -
+      with self.Profile('CalcComplex'):
+         complexity = CalcComplex(self.detector)
+      overComplex = np.maximum(0,
+                        complexity -
                         self.detector.parameters['site'].complexCredits)
       complexScale = 1 - overComplex / self.detector.parameters['site'].complexCredits
-      score.supernovaeMissed = int(
-         max(0, np.floor(score.supernovae * (1 - complexScale))))
-      score.nsnsMissed = int(max(0, np.floor(score.nsns * (1 - complexScale))))
-      score.bhbhMissed = int(max(0, np.floor(score.bhbh * (1 - complexScale))))
+      score.supernovaeMissed = WholeNumber(np.maximum(
+         0, np.floor(score.supernovae * (1 - complexScale))).astype(int))
+      score.nsnsMissed = WholeNumber(np.maximum(
+         0, np.floor(score.nsns * (1 - complexScale))).astype(int))
+      score.bhbhMissed = WholeNumber(np.maximum(
+         0, np.floor(score.bhbh * (1 - complexScale))).astype(int))
       return score
+
+   # Derivatives of the ranges, score and cost with respect to the
+   # continuous detector parameters, see gradient.CalcGradients
+   def CalcGradients(self, keys=None, step=1E-4):
+      from pystq.gradient import CalcGradients
+      return CalcGradients(self, keys, step)
+
+   # Score, cost and complexity of the detector as a dictionary with an entry
+   # per field, holding arrays of results for a DetectorBatch
+   def CalcScoreTable(self):
+      return self.ScoreTable(self.CalcScore())
+
+   # Table of a Score of the detector, as returned by CalcScoreTable
+   def ScoreTable(self, score):
+      table = {}
+      for field in scoreFields:
+         table[field] = np.broadcast_to(getattr(score, field),
+                                        self.detector.shape)[()]
+      with self.Profile('CalcCost'):
+         table['cost'] = CalcCost(self.detector)
+      with self.Profile('CalcComplex'):
+         table['complexity'] = CalcComplex(self.detector)
+      return table
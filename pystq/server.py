@@ -0,0 +1,269 @@
+import asyncio
+import json
+import urllib.error
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+from pystq.detector import Detector, DetectorBatch
+from pystq.score import ScoreCalculator
+
+# Headless scoring service. Designs are posted as JSON to an asyncio HTTP
+# front end, which collects the designs of concurrent requests for a short
+# window and scores them together as DetectorBatch objects in a process pool.
+#
+#   POST /score   {"designs": [{"depth": 100, ..., "site": "City",
+#                               "material": "Silicon"}, ...],
+#                  "freqrange": [0, 4]}
+#              -> {"results": [{"score": ..., "cost": ..., ...}, ...]}
+#   GET /health -> {"status": "ok"}
+#
+# Start it with "python -m pystq.server --port 8080" and query it with
+# ScoreClient.
+
+
+# Check a design posted to the service and return it with numeric values
+# as floats. Site and material are given by their option names.
+def ParseDesign(design):
+   if type(design) is not dict:
+      raise ValueError('A design must be a JSON object')
+   parsed = {}
+   for key in Detector.limits:
+      if key == 'freqrange':
+         continue
+      if key not in design:
+         raise ValueError('Missing parameter: ' + key)
+      value = design[key]
+      if type(value) not in (int, float):
+         raise ValueError('Parameter {} must be a number'.format(key))
+      low, high = Detector.limits[key]
+      if not low <= value <= high:
+         raise ValueError('Parameter {} must lie within [{}, {}]'.format(
+            key, low, high))
+      if type(low) is int and type(high) is int and value != int(value):
+         raise ValueError('Parameter {} must be a whole number'.format(key))
+      parsed[key] = float(value)
+   for key in Detector.options:
+      value = design.get(key)
+      if value not in Detector.options[key]:
+         raise ValueError('Parameter {} must be one of {}'.format(
+            key, ', '.join(Detector.options[key])))
+      parsed[key] = value
+   unknown = set(design) - set(parsed)
+   if len(unknown) > 0:
+      raise ValueError('Unknown parameters: ' + ', '.join(sorted(unknown)))
+   return parsed
+
+
+# Check a frequency range, in log10(Hz), posted to the service
+def CheckFreqRange(freqrange):
+   low, high = Detector.limits['freqrange']
+   if not low <= freqrange[0] < freqrange[1] <= high:
+      raise ValueError('freqrange must be increasing and lie within '
+                       '[{}, {}]'.format(low, high))
+
+
+# Score a list of parsed designs sharing a frequency range in one batch.
+# Runs in the worker processes of the service.
+def ScoreDesigns(designs, freqrange):
+   columns = {key: [design[key] for design in designs]
+              for key in designs[0]}
+   batch = DetectorBatch(columns, freqrange)
+   calculator = ScoreCalculator.Configured(batch, freqrange)
+   table = calculator.CalcScoreTable()
+   site = batch.parameters['site']
+   table['budget'] = site.budget
+   table['complexCredits'] = site.complexCredits
+   return [{key: np.asarray(table[key])[i].item() for key in table}
+           for i in range(len(designs))]
+
+
+class ScoreServer:
+
+   # Largest body accepted by the service, in bytes
+   maxRequestSize = 1 << 22
+
+   # workers is the number of scoring processes; with workers=0 designs are
+   # scored in a thread of the server process instead. Designs arriving
+   # within batchWindow seconds of each other are scored together, up to
+   # maxBatch at a time.
+   def __init__(self, host='127.0.0.1', port=8080, workers=None,
+                maxBatch=1024, batchWindow=0.01):
+      self.host = host
+      self.port = port
+      self.workers = workers
+      self.maxBatch = maxBatch
+      self.batchWindow = batchWindow
+      self.server = None
+
+   async def Start(self):
+      if self.workers == 0:
+         self.executor = ThreadPoolExecutor(1)
+      else:
+         self.executor = ProcessPoolExecutor(self.workers)
+      self.queue = asyncio.Queue()
+      self.batcher = asyncio.ensure_future(self.Batcher())
+      self.server = await asyncio.start_server(self.Handle, self.host,
+                                               self.port)
+      # Report the port actually bound when port 0 was requested
+      self.port = self.server.sockets[0].getsockname()[1]
+
+   async def Stop(self):
+      self.server.close()
+      await self.server.wait_closed()
+      self.batcher.cancel()
+      self.executor.shutdown()
+
+   # Serve until interrupted
+   def Run(self):
+
+      async def serve():
+         await self.Start()
+         print('Scoring service listening on {}:{}'.format(self.host,
+                                                          self.port))
+         try:
+            await self.server.serve_forever()
+         finally:
+            await self.Stop()
+
+      asyncio.run(serve())
+
+   # Queue a parsed design and wait for its result
+   async def Submit(self, design, freqrange):
+      future = asyncio.get_running_loop().create_future()
+      await self.queue.put((design, freqrange, future))
+      return await future
+
+   # Collect queued designs into batches and hand them to the executor
+   async def Batcher(self):
+      loop = asyncio.get_running_loop()
+      while True:
+         items = [await self.queue.get()]
+         deadline = loop.time() + self.batchWindow
+         while len(items) < self.maxBatch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+               break
+            try:
+               items.append(await asyncio.wait_for(self.queue.get(),
+                                                   timeout))
+            except asyncio.TimeoutError:
+               break
+         groups = {}
+         for item in items:
+            groups.setdefault(item[1], []).append(item)
+         for freqrange in groups:
+            asyncio.ensure_future(self.ScoreGroup(groups[freqrange]))
+
+   async def ScoreGroup(self, items):
+      loop = asyncio.get_running_loop()
+      try:
+         results = await loop.run_in_executor(
+            self.executor, ScoreDesigns, [item[0] for item in items],
+            items[0][1])
+      except Exception as e:
+         for item in items:
+            if not item[2].done():
+               item[2].set_exception(e)
+         return
+      for item, result in zip(items, results):
+         if not item[2].done():
+            item[2].set_result(result)
+
+   # Status and JSON reply for a request
+   async def Dispatch(self, method, path, body):
+      if path == '/health' and method == 'GET':
+         return 200, {'status': 'ok'}
+      if path != '/score':
+         return 404, {'error': 'Unknown path ' + path}
+      if method != 'POST':
+         return 405, {'error': 'Use POST to score designs'}
+      try:
+         request = json.loads(body.decode('utf-8'))
+         designs = request['designs']
+         freqrange = tuple(float(f) for f in request.get('freqrange',
+                                                         (0, 4)))
+         if type(designs) is not list or len(freqrange) != 2:
+            raise ValueError('Expected a list of designs and a freqrange '
+                             'of two numbers')
+         CheckFreqRange(freqrange)
+         designs = [ParseDesign(design) for design in designs]
+      except (ValueError, KeyError, TypeError) as e:
+         return 400, {'error': str(e)}
+      results = await asyncio.gather(
+         *[self.Submit(design, freqrange) for design in designs])
+      return 200, {'results': list(results)}
+
+   async def Handle(self, reader, writer):
+      try:
+         method, path, version = (await reader.readline()).decode(
+            'latin-1').split()
+         headers = {}
+         while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+               break
+            key, value = line.decode('latin-1').split(':', 1)
+            headers[key.strip().lower()] = value.strip()
+         length = int(headers.get('content-length', 0))
+         if length > self.maxRequestSize:
+            status, reply = 413, {'error': 'Request too large'}
+         else:
+            body = await reader.readexactly(length)
+            status, reply = await self.Dispatch(method, path, body)
+      except (ValueError, asyncio.IncompleteReadError):
+         status, reply = 400, {'error': 'Malformed request'}
+      except Exception as e:
+         status, reply = 500, {'error': str(e)}
+      payload = json.dumps(reply).encode('utf-8')
+      reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+                405: 'Method Not Allowed', 413: 'Payload Too Large',
+                500: 'Internal Server Error'}[status]
+      writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\n'
+                   'Content-Length: {}\r\nConnection: close\r\n\r\n'.format(
+                      status, reason, len(payload)).encode('latin-1') +
+                   payload)
+      try:
+         await writer.drain()
+      finally:
+         writer.close()
+
+
+# Client for a running ScoreServer
+class ScoreClient:
+
+   def __init__(self, host='127.0.0.1', port=8080, timeout=60):
+      self.url = 'http://{}:{}'.format(host, port)
+      self.timeout = timeout
+
+   def Request(self, path, payload=None):
+      data = None if payload is None else json.dumps(payload).encode('utf-8')
+      request = urllib.request.Request(
+         self.url + path, data=data,
+         headers={'Content-Type': 'application/json'})
+      try:
+         with urllib.request.urlopen(request, timeout=self.timeout) as reply:
+            return json.loads(reply.read().decode('utf-8'))
+      except urllib.error.HTTPError as e:
+         raise ValueError(json.loads(e.read().decode('utf-8'))['error'])
+
+   def Health(self):
+      return self.Request('/health')
+
+   # Score a list of designs (dictionaries of detector parameters, with site
+   # and material given by name) and return one result dictionary each
+   def Score(self, designs, freqrange=(0, 4)):
+      return self.Request('/score', {'designs': designs,
+                                     'freqrange': list(freqrange)})['results']
+
+
+if __name__ == '__main__':
+   import argparse
+   parser = argparse.ArgumentParser(description='Space Py Quest scoring '
+                                    'service')
+   parser.add_argument('--host', default='127.0.0.1')
+   parser.add_argument('--port', type=int, default=8080)
+   parser.add_argument('--workers', type=int, default=None)
+   parser.add_argument('--batch-window', type=float, default=0.01)
+   args = parser.parse_args()
+   ScoreServer(args.host, args.port, args.workers,
+               batchWindow=args.batch_window).Run()
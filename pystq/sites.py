@@ -1,3 +1,6 @@
+import numpy as np
+
+
 class City:
    complexCredits = 20
    budget = 95E6
@@ -32,3 +35,53 @@ class Island:
    X_hf = 9E-13
    f_c = 0.08
    n_0 = 2.5
+
+
+# All sites, in the order of Detector.options['site']. Batches of detectors
+# store their site as an index into this list.
+allSites = [City, Jungle, Desert, Island]
+
+
+class SiteColumns:
+   # Site constants gathered per configuration of a DetectorBatch, so that
+   # expressions such as detector.parameters['site'].X_dc broadcast over
+   # the batch exactly as they do for a single site class. values may
+   # replace the tabulated constants of some fields with arrays of one
+   # value per configuration.
+   fields = ['complexCredits', 'budget', 'X_dc', 'X_hf', 'f_c', 'n_0']
+
+   def __init__(self, index, values={}):
+      self.index = np.asarray(index, dtype=int)
+      for field in self.fields:
+         if field in values:
+            setattr(self, field, np.broadcast_to(
+               np.asarray(values[field], dtype=float), self.index.shape))
+         else:
+            setattr(self, field, siteTable[field][self.index])
+      # With the constants of allSites, quantities that only depend on the
+      # site are evaluated once per site, see PerSite
+      self.tabulated = len(values) == 0
+      self.perSite = {}
+
+   # function(f, site) for every configuration, evaluated for each of
+   # allSites and picked per configuration. f must end in an axis of length
+   # 1 for the configurations, as in score.EvaluateNoiseModel. The values
+   # are kept for the next call with the same function and frequencies.
+   # Returns None when this does not apply.
+   def PerSite(self, function, f):
+      if not self.tabulated or np.shape(f)[-1:] != (1,):
+         return None
+      cached = self.perSite.get(function)
+      if cached is None or not np.array_equal(cached[0], f):
+         cached = (np.array(f), function(f, everySite))
+         self.perSite[function] = cached
+      return cached[1][..., self.index]
+
+
+# Site constants as arrays in allSites order
+siteTable = {}
+for field in SiteColumns.fields:
+   siteTable[field] = np.array([getattr(site, field) for site in allSites],
+                               dtype=float)
+# Constants of allSites, one per column
+everySite = SiteColumns(np.arange(len(allSites)))
@@ -0,0 +1,185 @@
+import json
+import os
+import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pystq.detector import DetectorBatch
+from pystq.score import ScoreCalculator
+
+
+# num evenly spaced values from low to high, for an axis of ParameterSweep
+def Range(low, high, num):
+   return np.linspace(low, high, int(num))
+
+
+# Parameter sweeps over the keys of Detector.limits and the site and
+# material options. The grid is the product of the swept axes; it is scored
+# in chunks of DetectorBatch objects, spread over a pool of worker
+# processes. Scripts that run a sweep with several workers should do so
+# under "if __name__ == '__main__':", as required by process pools.
+class ParameterSweep:
+
+   # Largest number of configurations scored in one batch
+   maxChunkSize = 4096
+
+   # axes maps parameter keys to the sequences of values to sweep, such as
+   # Range(low, high, num) for evenly spaced values. For 'site' and
+   # 'material' the values are classes or option names.
+   # Parameters that are not swept take their value from base, which also
+   # holds the frequency range. noiseModels and noisesUsed are passed on to
+   # SetNoiseModels and SetNoiseUsed of every ScoreCalculator.
+   def __init__(self, axes, base={}, workers=None, chunkSize=None,
+                noiseModels={}, noisesUsed={}):
+      self.axes = [(key, self.AxisValues(axes[key])) for key in axes]
+      self.base = dict(base)
+      self.freqrange = self.base.pop('freqrange', (0, 4))
+      self.noiseModels = noiseModels
+      self.noisesUsed = noisesUsed
+      self.shape = tuple(len(values) for key, values in self.axes)
+      self.size = int(np.prod(self.shape))
+      self.workers = workers or os.cpu_count() or 1
+      # Several chunks per worker keep the pool busy when chunks differ in
+      # run time
+      self.chunkSize = chunkSize or int(min(
+         self.maxChunkSize, max(1, np.ceil(self.size / (4 * self.workers)))))
+
+   @staticmethod
+   def AxisValues(values):
+      if any(type(value) in (str, type) for value in values):
+         return np.array(values, dtype=object)
+      return np.asarray(values, dtype=float)
+
+   # (start, stop) ranges of the flat grid index, one per chunk
+   def Chunks(self):
+      for start in range(0, self.size, self.chunkSize):
+         yield start, min(start + self.chunkSize, self.size)
+
+   # Batch of the configurations start to stop of the grid
+   def GetBatch(self, chunk):
+      start, stop = chunk
+      index = np.unravel_index(np.arange(start, stop), self.shape)
+      columns = {}
+      for key in self.base:
+         columns[key] = [self.base[key]] * (stop - start)
+      for (key, values), i in zip(self.axes, index):
+         columns[key] = values[i]
+      return DetectorBatch(columns, self.freqrange)
+
+   # Result table of one chunk: the detector parameters, with site and
+   # material as indices, followed by cost, complexity and the score fields
+   def ScoreChunk(self, chunk):
+      batch = self.GetBatch(chunk)
+      calculator = ScoreCalculator.Configured(
+         batch, self.freqrange, self.noiseModels, self.noisesUsed)
+      table = dict(batch.columns)
+      table['site'] = batch.siteIndex
+      table['material'] = batch.materialIndex
+      table.update(calculator.CalcScoreTable())
+      return table
+
+   # Score the grid chunk by chunk and yield (chunk, table) pairs in grid
+   # order. At most maxPending chunks are queued in the worker pool at a
+   # time (two per worker by default), so memory use does not grow with the
+   # size of the grid.
+   def Stream(self, maxPending=None):
+      chunks = self.Chunks()
+      if self.workers == 1 or self.size <= self.chunkSize:
+         for chunk in chunks:
+            yield chunk, self.ScoreChunk(chunk)
+         return
+      maxPending = maxPending or 2 * self.workers
+      with ProcessPoolExecutor(self.workers) as executor:
+         pending = deque()
+         for chunk in chunks:
+            pending.append((chunk, executor.submit(self.ScoreChunk, chunk)))
+            if len(pending) >= maxPending:
+               chunk, future = pending.popleft()
+               yield chunk, future.result()
+         while pending:
+            chunk, future = pending.popleft()
+            yield chunk, future.result()
+
+   # Score the whole grid and return one table, a dictionary of columns in
+   # flat grid order
+   def Run(self):
+      return ConcatenateTables([table for chunk, table in self.Stream()])
+
+   # Score the whole grid into directory, written chunk by chunk as one .npy
+   # file per column (see SweepWriter), and return the number of rows
+   def Write(self, directory, maxPending=None):
+      axes = {key: [value if type(value) is str else
+                    getattr(value, '__name__', None) or float(value)
+                    for value in values] for key, values in self.axes}
+      writer = SweepWriter(directory, self.size,
+                           {'axes': axes, 'shape': list(self.shape),
+                            'freqrange': list(self.freqrange)})
+      try:
+         for chunk, table in self.Stream(maxPending):
+            writer.Append(table)
+      finally:
+         writer.Close()
+      return writer.rows
+
+
+# Writes a table of known length to a directory, one .npy file per column,
+# appending rows as they come so that only the rows being appended are held
+# in memory. The files are complete .npy files once all rows are written,
+# and sweep.json then lists the columns with the metadata given. Read the
+# result with ReadSweep.
+class SweepWriter:
+
+   def __init__(self, directory, size, metadata={}):
+      os.makedirs(directory, exist_ok=True)
+      self.directory = directory
+      self.size = size
+      self.metadata = metadata
+      self.files = {}
+      self.dtypes = {}
+      self.rows = 0
+
+   def Append(self, table):
+      rows = None
+      for key in table:
+         column = np.asarray(table[key])
+         if key not in self.files:
+            self.Open(key, column.dtype)
+         column.astype(self.dtypes[key], copy=False).tofile(self.files[key])
+         rows = len(column)
+      self.rows += rows or 0
+
+   def Open(self, key, dtype):
+      self.dtypes[key] = dtype
+      file = open(os.path.join(self.directory, key + '.npy'), 'wb')
+      np.lib.format.write_array_header_1_0(file, {
+         'descr': np.lib.format.dtype_to_descr(dtype),
+         'fortran_order': False,
+         'shape': (self.size,)})
+      self.files[key] = file
+
+   # Close the column files, and write sweep.json if every row was written
+   def Close(self):
+      for file in self.files.values():
+         file.close()
+      if self.rows == self.size:
+         manifest = dict(self.metadata)
+         manifest['size'] = self.size
+         manifest['columns'] = list(self.files)
+         with open(os.path.join(self.directory, 'sweep.json'), 'w') as file:
+            json.dump(manifest, file, indent=1)
+
+
+# Columns of a table written by SweepWriter, as read-only memory maps
+def ReadSweep(directory):
+   path = os.path.join(directory, 'sweep.json')
+   if not os.path.exists(path):
+      raise ValueError('No complete sweep in ' + directory)
+   with open(path) as file:
+      manifest = json.load(file)
+   return {key: np.load(os.path.join(directory, key + '.npy'), mmap_mode='r')
+           for key in manifest['columns']}
+
+
+# Join tables (dictionaries of columns) row-wise
+def ConcatenateTables(tables):
+   return {key: np.concatenate([table[key] for table in tables])
+           for key in tables[0]}
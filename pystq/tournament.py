@@ -0,0 +1,138 @@
+from numbers import Real
+
+import numpy as np
+from pystq import materials, sites
+from pystq.detector import Detector, DetectorBatch
+from pystq.score import ScoreCalculator
+
+
+# Tournament of submitted designs. Every submission is scored at each of
+# sites.allSites with each of materials.allMaterials, 16 events in all. The
+# submissions are scored together in DetectorBatch objects, so that they
+# share one frequency grid and the seismic ground motion of each site (see
+# sites.SiteColumns.PerSite).
+class Tournament:
+
+   # Largest number of configurations scored in one batch
+   maxChunkSize = 4096
+
+   # submissions maps names to designs: dictionaries holding a value within
+   # Detector.limits for every parameter but freqrange. site and material
+   # may be given but are ignored. A design loses budgetPenalty times its
+   # score for every budget it spends beyond the budget of the site, and
+   # complexPenalty times its score for every complexCredits of the site
+   # its complexity goes beyond, down to a score of zero.
+   def __init__(self, submissions, budgetPenalty=1.0, complexPenalty=1.0,
+                freqrange=(0, 4), chunkSize=None, noiseModels={},
+                noisesUsed={}):
+      if len(submissions) == 0:
+         raise ValueError('A tournament needs at least one submission')
+      self.names = list(submissions)
+      self.keys = [key for key in Detector.limits if key != 'freqrange']
+      self.designs = np.array([self.CheckDesign(name, submissions[name])
+                               for name in self.names], dtype=float)
+      self.budgetPenalty = budgetPenalty
+      self.complexPenalty = complexPenalty
+      self.freqrange = freqrange
+      self.noiseModels = noiseModels
+      self.noisesUsed = noisesUsed
+      self.events = len(sites.allSites) * len(materials.allMaterials)
+      # Chunks hold whole submissions, all of their events
+      self.chunkSize = max(1, (chunkSize or self.maxChunkSize) // self.events)
+
+   # Parameter values of a design in the order of self.keys
+   def CheckDesign(self, name, design):
+      values = []
+      for key in self.keys:
+         if key not in design:
+            raise ValueError('Submission {}: missing parameter {}'.format(
+               name, key))
+         value = design[key]
+         if not isinstance(value, Real) or isinstance(value, bool):
+            raise ValueError('Submission {}: parameter {} must be a number'
+                             .format(name, key))
+         low, high = Detector.limits[key]
+         if not low <= value <= high:
+            raise ValueError(
+               'Submission {}: parameter {} must lie within [{}, {}]'.format(
+                  name, key, low, high))
+         if key in Detector.integerKeys and value != int(value):
+            raise ValueError(
+               'Submission {}: parameter {} must be a whole number'.format(
+                  name, key))
+         values.append(value)
+      return values
+
+   # Batch of every event of the submissions start to stop, ordered by
+   # submission, site and material
+   def GetBatch(self, start, stop):
+      shape = (stop - start, len(sites.allSites), len(materials.allMaterials))
+      submission, site, material = np.indices(shape).reshape(3, -1)
+      columns = {key: self.designs[start + submission, j]
+                 for j, key in enumerate(self.keys)}
+      columns['site'] = site
+      columns['material'] = material
+      return DetectorBatch(columns, self.freqrange)
+
+   def ScoreChunk(self, start, stop):
+      return ScoreCalculator.Configured(
+         self.GetBatch(start, stop), self.freqrange, self.noiseModels,
+         self.noisesUsed).CalcScoreTable()
+
+   # Score every event and rank the submissions. Returns a dictionary with
+   # the fields of ScoreCalculator.CalcScoreTable as (submissions x sites x
+   # materials) arrays, together with:
+   #   overBudget, overComplex - relative excess of cost and complexity
+   #   points - the score after penalties
+   #   rank - rank of each submission in each event, 1 being the best
+   #   total, meanRank - points summed and ranks averaged over the events
+   #   overallRank - rank by total points
+   # and the names of the submissions, sites and materials.
+   def Run(self):
+      tables = [self.ScoreChunk(start, min(start + self.chunkSize,
+                                           len(self.names)))
+                for start in range(0, len(self.names), self.chunkSize)]
+      shape = (len(self.names), len(sites.allSites),
+               len(materials.allMaterials))
+      result = {key: np.concatenate([table[key] for table in tables])
+                .reshape(shape) for key in tables[0]}
+
+      budget = sites.siteTable['budget'][:, None]
+      credits = sites.siteTable['complexCredits'][:, None]
+      result['overBudget'] = np.maximum(0, result['cost'] / budget - 1)
+      result['overComplex'] = np.maximum(
+         0, result['complexity'] / credits - 1)
+      penalty = self.budgetPenalty * result['overBudget'] + \
+         self.complexPenalty * result['overComplex']
+      result['points'] = result['score'] * np.maximum(0, 1 - penalty)
+
+      result['rank'] = Ranks(result['points'])
+      result['total'] = result['points'].sum(axis=(1, 2))
+      result['meanRank'] = result['rank'].mean(axis=(1, 2))
+      result['overallRank'] = Ranks(result['total'])
+      result['names'] = self.names
+      result['sites'] = list(Detector.options['site'])
+      result['materials'] = list(Detector.options['material'])
+      return result
+
+   # Run the tournament and return (rank, name, total points, mean rank)
+   # rows, best first
+   def Leaderboard(self):
+      result = self.Run()
+      order = np.argsort(result['overallRank'], kind='stable')
+      return [(int(result['overallRank'][i]), self.names[i],
+               float(result['total'][i]), float(result['meanRank'][i]))
+              for i in order]
+
+
+# Competition ranks of points along the first axis, 1 for the highest.
+# Equal points share the best of their ranks.
+def Ranks(points):
+   points = np.where(np.isnan(points), -np.inf, points)
+   higher = np.sort(-points, axis=0)
+   ranks = np.empty(points.shape, dtype=int)
+   for index in np.ndindex(points.shape[1:]):
+      column = (slice(None),) + index
+      ranks[column] = np.searchsorted(higher[column], -points[column],
+                                      side='left') + 1
+   return ranks
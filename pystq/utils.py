@@ -1,5 +1,189 @@
+import numpy as np
+
+
+# LerpTables of the tables passed to LerpArray, keyed by their values, as the
+# arrays may be changed in place. Cleared once it holds maxLerpTables tables.
+lerpTables = {}
+maxLerpTables = 64
+
+
+# Linear interpolation of t in the table (x, y). Values outside the table are
+# extrapolated from its first or last segment. t may be an array.
 def LerpArray(x, y, t):
-   i = 0
-   while (i < (len(x) - 2) and t > x[i + 1]):
-      i += 1
-   return (y[i] * (x[i + 1] - t) + y[i + 1] * (t - x[i])) / (x[i + 1] - x[i])
+   x = np.array(x, dtype=float)
+   y = np.array(y, dtype=float)
+   key = (x.tobytes(), y.tobytes())
+   table = lerpTables.get(key)
+   if table is None:
+      if len(lerpTables) >= maxLerpTables:
+         lerpTables.clear()
+      table = lerpTables[key] = LerpTable(x, y)
+   return table(t)
+
+
+class LerpTable:
+   # Piecewise linear table with its segment slopes precomputed, so that a
+   # lookup is a single binary search over the table. Behaves like LerpArray.
+   def __init__(self, x, y):
+      self.x = np.asarray(x, dtype=float)
+      self.y = np.asarray(y, dtype=float)
+      self.slope = np.diff(self.y) / np.diff(self.x)
+
+   def __call__(self, t):
+      i = np.clip(np.searchsorted(self.x, t) - 1, 0, len(self.x) - 2)
+      return self.y[i] + self.slope[i] * (t - self.x[i])
+
+
+class LerpTables:
+   # Several LerpTables searched together, for arrays of (table index, t)
+   # pairs. The tables are concatenated with their x values shifted into
+   # disjoint bands, so that one binary search serves every table; the
+   # segment index is then clipped to the band of the requested table.
+   def __init__(self, tables):
+      xs = [np.asarray(x, dtype=float) for x, y in tables]
+      lo = min(x[0] for x in xs)
+      hi = max(x[-1] for x in xs)
+      self.band = 2 * (hi - lo) + 1
+      lengths = np.array([len(x) for x in xs])
+      self.first = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+      self.last = self.first + lengths - 2
+      self.offset = self.band * np.arange(len(tables))
+      self.x = np.concatenate([x + o for x, o in zip(xs, self.offset)])
+      self.y = np.concatenate([np.asarray(y, dtype=float) for x, y in tables])
+      self.slope = np.append(np.diff(self.y) / np.diff(self.x), 0)
+
+   def __call__(self, index, t):
+      t = t + self.offset[index]
+      i = np.clip(np.searchsorted(self.x, t) - 1, self.first[index],
+                  self.last[index])
+      return self.y[i] + self.slope[i] * (t - self.x[i])
+
+
+class CumulativeIntegral:
+   # Running integral of y over x along the last axis, for a grid x that is
+   # uniformly spaced in log(x) such as np.logspace. The integration runs in
+   # log(x), where the integrands on such grids vary slowly, using the
+   # quadratics through neighbouring points (Simpson-like accuracy). Calling
+   # the object returns the integral from x[0] up to any point in the grid.
+   def __init__(self, x, y):
+      n = np.shape(x)[-1]
+      self.u0 = np.log(x[0])
+      self.h = (np.log(x[-1]) - self.u0) / (n - 1)
+      self.g = np.asarray(y) * x
+      g = self.g
+      steps = np.empty(g.shape[:-1] + (n - 1,))
+      steps[..., 0] = 5 * g[..., 0] + 8 * g[..., 1] - g[..., 2]
+      steps[..., -1] = 5 * g[..., -1] + 8 * g[..., -2] - g[..., -3]
+      steps[..., 1:-1] = (13 * (g[..., 1:-2] + g[..., 2:-1]) - g[..., :-3] -
+                          g[..., 3:]) / 2
+      steps *= self.h / 12
+      self.values = np.zeros(g.shape)
+      np.cumsum(steps, axis=-1, out=self.values[..., 1:])
+
+   # Integrals of the quadratic through three points spaced by one step,
+   # from the first point up to t steps after it, per point
+   @staticmethod
+   def QuadraticWeights(t):
+      return ((t**3 / 3 - 1.5 * t**2 + 2 * t) / 2, t**2 - t**3 / 3,
+              (t**3 / 3 - t**2 / 2) / 2)
+
+   def __call__(self, x):
+      n = self.g.shape[-1]
+      s = np.clip((np.log(x) - self.u0) / self.h, 0, n - 1)
+      i = np.minimum(np.floor(s).astype(int), n - 2)
+      b = np.minimum(i, n - 3)
+      w = [wt - wi for wt, wi in zip(self.QuadraticWeights(s - b),
+                                     self.QuadraticWeights(i - b))]
+      return self.values[..., i] + self.h * (
+         w[0] * self.g[..., b] + w[1] * self.g[..., b + 1] +
+         w[2] * self.g[..., b + 2])
+
+
+class AdaptiveIntegral:
+   # Running integral of func(x) from x0 to x1, with the sampling adapted to
+   # the integrand. The range is split into panels of three points, evenly
+   # spaced in log(x), which are bisected while the Simpson estimates of a
+   # panel and of its two halves differ by more than tolerance times the
+   # total, prorated by the panel's share of the range. func takes an array
+   # of x and returns values with x along the last axis; any leading axes
+   # (several integrands, a batch of detectors) are refined together.
+   # Calling the object returns the integral from x0 up to any point in the
+   # range, like CumulativeIntegral; 'evaluations' counts the points of x at
+   # which func was evaluated. The points x at which the integral will be
+   # read may be given. The range is then split at them into parts, which
+   # are refined to the tolerance of their own totals, so that the integral
+   # up to every point is accurate to the tolerance.
+   def __init__(self, func, x0, x1, tolerance, panels=16,
+                maxEvaluations=100000, points=()):
+      u0 = np.log(x0)
+      u1 = np.log(x1)
+      self.evaluations = 0
+
+      def g(u):
+         self.evaluations += len(u)
+         return func(np.exp(u)) * np.exp(u)
+
+      # Parts of the range, each starting as panels of about the width of
+      # the range over panels
+      u = np.log(np.asarray(points, dtype=float).ravel())
+      bounds = np.unique(np.concatenate([[u0], u[(u > u0) & (u < u1)], [u1]]))
+      widths = np.diff(bounds)
+      counts = np.maximum(1, np.round(widths / (u1 - u0) * panels)).astype(int)
+
+      # Active panels: start, half width, part and the values at start,
+      # middle and end. The x of the initial panels are evaluated in one call.
+      part = np.repeat(np.arange(len(widths)), counts)
+      start = np.concatenate([np.linspace(bounds[i], bounds[i + 1], counts[i],
+                                          endpoint=False)
+                              for i in range(len(widths))])
+      h = np.diff(np.append(start, u1)) / 2
+      n = len(start)
+      values = g(np.concatenate([start, start + h, [u1]]))
+      ga, gm = values[..., :n], values[..., n:2 * n]
+      gb = np.concatenate([values[..., 1:n], values[..., 2 * n:]], axis=-1)
+      leaves = []
+      total = np.add.reduceat(np.abs(h / 3 * (ga + 4 * gm + gb)),
+                              np.cumsum(counts) - counts, axis=-1)
+      scale = np.where(total > 0, total, 1)
+      while len(start) > 0:
+         quarters = g(np.concatenate([start + h / 2, start + 3 * h / 2]))
+         gl, gr = quarters[..., :len(start)], quarters[..., len(start):]
+         coarse = h / 3 * (ga + 4 * gm + gb)
+         fine = h / 6 * (ga + 4 * gl + 2 * gm + 4 * gr + gb)
+         error = np.abs(fine - coarse) / scale[..., part]
+         error = error.reshape((-1, len(start))).max(axis=0)
+         done = (error <= 15 * tolerance * 2 * h / widths[part]) | (
+            self.evaluations >= maxEvaluations)
+         # Accepted panels are kept as their two halves; the others are
+         # bisected and tested again
+         leaves.append((start[done], h[done] / 2, ga[..., done],
+                        gl[..., done], gm[..., done]))
+         leaves.append((start[done] + h[done], h[done] / 2, gm[..., done],
+                        gr[..., done], gb[..., done]))
+         todo = ~done
+         start = np.concatenate([start[todo], start[todo] + h[todo]])
+         h = np.concatenate([h[todo], h[todo]]) / 2
+         part = np.concatenate([part[todo], part[todo]])
+         ga, gm, gb = (np.concatenate([ga[..., todo], gm[..., todo]], axis=-1),
+                       np.concatenate([gl[..., todo], gr[..., todo]], axis=-1),
+                       np.concatenate([gm[..., todo], gb[..., todo]], axis=-1))
+
+      self.start, self.h, ga, gm, gb = [np.concatenate(part, axis=-1)
+                                        for part in zip(*leaves)]
+      order = np.argsort(self.start)
+      self.start, self.h = self.start[order], self.h[order]
+      self.g = np.stack([ga[..., order], gm[..., order], gb[..., order]])
+      simpson = self.h / 3 * (self.g[0] + 4 * self.g[1] + self.g[2])
+      self.values = np.zeros(simpson.shape)
+      np.cumsum(simpson[..., :-1], axis=-1, out=self.values[..., 1:])
+      self.end = self.start[-1] + 2 * self.h[-1]
+
+   def __call__(self, x):
+      u = np.clip(np.log(x), self.start[0], self.end)
+      i = np.clip(np.searchsorted(self.start, u, side='right') - 1, 0,
+                  len(self.start) - 1)
+      h = self.h[i]
+      w = CumulativeIntegral.QuadraticWeights((u - self.start[i]) / h)
+      return self.values[..., i] + h * (w[0] * self.g[0][..., i] +
+                                        w[1] * self.g[1][..., i] +
+                                        w[2] * self.g[2][..., i])
@@ -1,9 +1,14 @@
+import html
+import threading
+import traceback
 import numpy as np
 import ipywidgets as pywidgets
 import pystq.score as score
 import pystq.sites as sites
 import pystq.materials as materials
 # From imports
+from concurrent.futures import ThreadPoolExecutor
+from pystq.cache import ResultCache, defaultDirectory
 from pystq.detector import Detector
 from IPython.display import display
 from ipywidgets import interactive
@@ -15,14 +20,24 @@ from bokeh.plotting import figure
 from bokeh.palettes import Dark2_8 as palette
 from bokeh.palettes import Category20_20 as palettelight
 from bokeh.models.formatters import TickFormatter, NumeralTickFormatter
-output_notebook(hide_banner=True)
+
+# Bokeh output is directed to the notebook when the first game is created,
+# rather than when this module is imported
+notebookReady = False
 
 
 # Set up 'Space-Time Quest'-like game class
 class spaceTimeQuest:
 
-   # Initialise the game
-   def __init__(self, init_vals={}):
+   # Initialise the game. With profile=True the time spent in each noise
+   # model and calculation is shown below the score. With cache=True,
+   # designs scored before, also in earlier sessions, are read back from
+   # ~/.cache/pystq; cache may also name another directory.
+   def __init__(self, init_vals={}, profile=False, cache=False):
+      global notebookReady
+      if not notebookReady:
+         output_notebook(hide_banner=True)
+         notebookReady = True
       # Interactive detector
       self.detector = Detector(init_vals)
       # Detector parameter keys
@@ -33,9 +48,22 @@ class spaceTimeQuest:
       self.detectnames = self.detector.names
       # Score calculator used in game
       self.scorecalculator = score.ScoreCalculator(self.detector)
+      if cache:
+         directory = defaultDirectory if cache is True else cache
+         self.scorecalculator.SetResultCache(ResultCache(directory))
+      self.scorecalculator.SetProfiling(profile)
       # Initial y-axis limits
       self.yLo = 1E-25
       self.yHi = 1E-21
+      # Recomputations triggered by the widgets run in a background thread.
+      # Changes within redrawDelay seconds of each other are merged, and
+      # every change increases redrawGeneration so that results computed
+      # for an older state are dropped.
+      self.redrawDelay = 0.15
+      self.redrawGeneration = 0
+      self.redrawTimer = None
+      self.redrawLock = threading.Lock()
+      self.executor = ThreadPoolExecutor(max_workers=1)
       # Initialise plot
       self.initPlot()
       # Initialise widgets
@@ -53,6 +81,14 @@ class spaceTimeQuest:
       return str(int(score.CalcCost(self.detector)/self.detector.parameters['site'].budget*100.0)) +\
             "% of budget blown"
 
+   # Timings of the score calculator as preformatted text, or nothing if
+   # profiling is switched off
+   def profileMsg(self):
+      if self.scorecalculator.stats is None:
+         return ''
+      return '<pre>' + html.escape(self.scorecalculator.stats.Report()) + \
+         '</pre>'
+
    # Print everything calculated about the capabilities of the detector
    def printscore(self):
       s = self.scorecalculator.CalcScore()
@@ -77,6 +113,8 @@ class spaceTimeQuest:
 
    # Set y-limits of the plot
    def setPlotYLim(self, hLo, hHi):
+      self.yLo = hLo
+      self.yHi = hHi
       self.plot.y_range.start = hLo
       self.plot.y_range.end = hHi
 
@@ -121,18 +159,15 @@ class spaceTimeQuest:
       self.legends = []
       self.colours = {}
       self.lines = {}
-      for i, yi in enumerate(y):
-         self.colours[self.names[i]] = palette[i]
-         # TODO: fix this, adf 14.02.2018
-         # the following is a workaround for a Bokeh bug which
-         # causes lines to not be clipped at the X/Y limits
-         # See: https://github.com/bokeh/bokeh/issues/6787
-         yi=np.array(yi)
-         x=np.array(x)
-         idxs = np.nonzero((yi<=self.yHi) & (yi>=self.yLo))[0]
-         self.lines[self.names[i]] = self.plot.line(x[idxs], yi[idxs], color=palette[i], \
-                                                    line_width=3)
-         self.legends.append((self.names[i], [self.lines[self.names[i]]]))
+      # Data last sent to each line
+      self.sentData = {}
+      xs, ys = self.plotData(x, y)
+      for i, name in enumerate(self.names):
+         self.colours[name] = palette[i]
+         self.lines[name] = self.plot.line(xs[i], ys[i], color=palette[i], \
+                                           line_width=3)
+         self.sentData[name] = (xs[i], ys[i])
+         self.legends.append((name, [self.lines[name]]))
       self.layoutLegend(self.legends)
       # show freq axis as 1 10 ... 10k
       self.plot.xaxis.formatter=NumeralTickFormatter(format="0 a")
@@ -148,42 +183,80 @@ class spaceTimeQuest:
          description=' '
       )
 
+      self.profile = pywidgets.HTML(value=self.profileMsg())
+
       self.handle = show(self.plot, notebook_handle=True)
       return self.budget
 
-   # Update the existing plot
-   def drawToPlot(self):
+   # Prepare the curves y (one row per curve) on the frequencies x for the
+   # plot in one vectorised pass. Curves with more than two points per pixel
+   # column are reduced to the lowest and highest point of every column, and
+   # points outside the y-range are set to NaN.
+   # TODO: fix this, adf 14.02.2018
+   # the clipping is a workaround for a Bokeh bug which
+   # causes lines to not be clipped at the X/Y limits
+   # See: https://github.com/bokeh/bokeh/issues/6787
+   def plotData(self, x, y):
+      x = np.asarray(x)
+      y = np.asarray(y, dtype=float)
+      lines, n = y.shape
+      step = n // self.plot.plot_width
+      if step >= 2:
+         m = (n // step) * step
+         blocks = y[:, :m].reshape(lines, -1, step)
+         index = np.sort(np.stack([blocks.argmin(axis=2),
+                                   blocks.argmax(axis=2)], axis=2), axis=2)
+         index = index + np.arange(0, m, step)[:, np.newaxis]
+         index = np.concatenate([index.reshape(lines, -1),
+                                 np.tile(np.arange(m, n), (lines, 1))],
+                                axis=1)
+      else:
+         index = np.tile(np.arange(n), (lines, 1))
+      xs = x[index]
+      ys = np.take_along_axis(y, index, axis=1)
+      ys[(ys > self.yHi) | (ys < self.yLo)] = np.nan
+      return xs, ys
+
+   # Send new data to a line in a single update, unless the plot already
+   # shows it
+   def updateLine(self, name, x, y):
+      sentX, sentY = self.sentData[name]
+      if np.array_equal(sentX, x) and np.array_equal(sentY, y,
+                                                     equal_nan=True):
+         return
+      self.lines[name].data_source.data = {'x': x, 'y': y}
+      self.sentData[name] = (x, y)
+
+   # Update the existing plot. When called for a redraw request, nothing is
+   # pushed if a newer request has arrived while the curves were computed.
+   def drawToPlot(self, generation=None):
       fi = self.detector.parameters['freqrange'][0]
       ff = self.detector.parameters['freqrange'][1]
       self.scorecalculator.SetFreqRange(fi, ff)
       x, y, names = self.scorecalculator.GetNoiseCurves()
-      for i, yi in enumerate(y):
-         # TODO: fix this, adf 14.02.2018
-         # the following is a workaround for a Bokeh bug which
-         # causes lines to not be clipped at the X/Y limits
-         # See: https://github.com/bokeh/bokeh/issues/6787
-         yi=np.array(yi)
-         x=np.array(x)
-         idxs = np.nonzero((yi<=self.yHi) & (yi>=self.yLo))[0]
-
-         if names[i] not in self.names:
-            self.colours[names[i]] = palettelight[i]
-            self.lines[names[i]] = self.plot.line(x[idxs], yi[idxs], color=palettelight[i], \
-                                                  line_width=10)
-            label = Label(x=x[int(len(x)/2)], y=yi[int(len(yi)/2)],
-                          text=names[i], x_offset=7, y_offset=3, level='glyph', \
+      if generation is not None and generation != self.redrawGeneration:
+         return
+      xs, ys = self.plotData(x, y)
+      for i, name in enumerate(names):
+         if name not in self.lines:
+            self.colours[name] = palettelight[i]
+            self.lines[name] = self.plot.line(xs[i], ys[i], color=palettelight[i], \
+                                              line_width=10)
+            self.sentData[name] = (xs[i], ys[i])
+            label = Label(x=x[int(len(x)/2)], y=y[i][int(len(y[i])/2)],
+                          text=name, x_offset=7, y_offset=3, level='glyph', \
                           render_mode='canvas', text_color=palettelight[i], \
                           text_font_size='8pt')
             self.plot.add_layout(label)
          else:
-            self.lines[names[i]].data_source.data['x'] = x[idxs]
-            self.lines[names[i]].data_source.data['y'] = yi[idxs]
-      for nm in self.names:
-         if nm not in names:
-            self.lines[nm].data_source.data['x'] = x
-            self.lines[nm].data_source.data['y'] = [0] * len(x)
+            self.updateLine(name, xs[i], ys[i])
+      # Curves that are switched off are emptied
+      for name in self.lines:
+         if name not in names:
+            self.updateLine(name, xs[0][:0], ys[0][:0])
 
       self.budget.value = self.budgetMsg()
+      self.profile.value = self.profileMsg()
       push_notebook()
 
    # Initialise all of the widgets
@@ -232,7 +305,7 @@ class spaceTimeQuest:
             readout=True,
             readout_format='',
             style=style)
-         if key == 'sus_stages':
+         if key in Detector.integerKeys:
             w[key].step = 1
 
       for key in choiceList:
@@ -253,13 +326,19 @@ class spaceTimeQuest:
             value=True, description=str(key), disabled=False, style=style)
       return w
 
-   # Update detector
-   def updateDetector(self):
+   # Current values of the detector and noise curve widgets
+   def widgetState(self):
+      return {key: self.pyw[key].value for key in self.keys + self.names}
+
+   # Update detector, from the given widget state or the widgets themselves
+   def updateDetector(self, state=None):
+      if state is None:
+         state = self.widgetState()
       for key in self.keys:
-         self.detector.parameters[key] = self.pyw[key].value
+         self.detector.parameters[key] = state[key]
       for key in self.names:
          if key != 'Total':
-            self.scorecalculator.SetNoiseUsed(key, self.pyw[key].value)
+            self.scorecalculator.SetNoiseUsed(key, state[key])
 
       if ("Jungle" in str(self.detector.parameters['site'])):
          self.detector.parameters['site'] = sites.Jungle
@@ -283,6 +362,52 @@ class spaceTimeQuest:
       else:
          print("Unrecognised material")
 
+   # Schedule a redraw for the current widget state, replacing any redraw
+   # that has not started yet
+   def requestRedraw(self):
+      state = self.widgetState()
+      with self.redrawLock:
+         self.redrawGeneration += 1
+         if self.redrawTimer is not None:
+            self.redrawTimer.cancel()
+         self.redrawTimer = threading.Timer(
+            self.redrawDelay, self.submitRedraw,
+            [state, self.redrawGeneration])
+         self.redrawTimer.start()
+
+   def submitRedraw(self, state, generation):
+      future = self.executor.submit(self.redraw, state, generation)
+      future.add_done_callback(self.reportError)
+
+   # Errors raised in the background thread, for example by a user-defined
+   # noise model, are printed and shown in place of the score
+   def reportError(self, future):
+      error = future.exception()
+      if error is None:
+         return
+      traceback.print_exception(type(error), error, error.__traceback__)
+      self.score.value = '<pre>' + html.escape(
+         ''.join(traceback.format_exception_only(type(error), error))) + \
+         '</pre>'
+
+   # Runs in the background thread
+   def redraw(self, state, generation):
+      if generation != self.redrawGeneration:
+         return
+      self.updateDetector(state)
+      self.drawToPlot(generation)
+
+   # Score the current widget state in the background thread, after any
+   # redraw that is already running, and wait for the result
+   def scienceRun(self):
+      state = self.widgetState()
+
+      def run():
+         self.updateDetector(state)
+         return self.printscore()
+
+      return self.executor.submit(run).result()
+
    # Set up the tasks that each widget controls
    def configureWidgetTasks(self):
 
@@ -290,27 +415,26 @@ class spaceTimeQuest:
 
       # Link pywidgets to updating plot
       def u(widge):
-         self.updateDetector()
-         self.drawToPlot()
+         self.requestRedraw()
          self.score.description = ' '
          self.score.value = ' '
 
       # Link check boxes to updating plot
       def c(widge):
-         self.updateDetector()
-         self.drawToPlot()
+         self.requestRedraw()
          self.score.description = ' '
          self.score.value = ' '
 
       # Science run button function
       def b(widge):
-         self.score.value = self.printscore()
+         self.score.value = self.scienceRun()
          self.score.description = 'Score: '
+         self.profile.value = self.profileMsg()
 
       # Y-axis limit change slider
       def y(widge):
          self.setPlotYLim(pow(10, widge[0]), pow(10, widge[1]))
-         self.drawToPlot()
+         self.requestRedraw()
          self.score.description = ' '
          self.score.value = ' '
 
@@ -388,7 +512,7 @@ class spaceTimeQuest:
       office.append(actions['Science Run'])
 
       tabpairs = {
-      'Office' : pywidgets.HBox([pywidgets.VBox(office), pywidgets.VBox([self.budget, self.score])]),
+      'Office' : pywidgets.HBox([pywidgets.VBox(office), pywidgets.VBox([self.budget, self.score, self.profile])]),
       'Environment' : pywidgets.HBox([pywidgets.VBox(environment), self.budget]),
       'Optics' : pywidgets.HBox([pywidgets.VBox(optics), self.budget]),
       'Suspension' : pywidgets.HBox([pywidgets.VBox(suspension), self.budget])
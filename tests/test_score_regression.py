@@ -0,0 +1,169 @@
+import pickle
+
+import numpy as np
+import pytest
+from scipy.integrate import simpson
+
+import translate
+from pystq import materials, sites
+from pystq.cache import ResultCache
+from pystq.detector import Detector, DetectorBatch
+from pystq.population import RandomPopulation
+from pystq.score import (CalcComplex, CalcCost, DistanceFromIntegral,
+                         GetBinaryTerms, ScoreCalculator)
+
+
+# Designs with their cost, complexity and NS-NS and BH-BH counts, as given
+# by the original score calculator
+designs = [
+   (dict(depth=0.0, pumps=5, temperature=290.0, sus_stages=3, sus_length=1.0,
+         mirror_mass=20.0, power=50.0, roughness=100),
+    23545178.73336883, 9.344843049327354, 1, 6),
+   (dict(depth=600.0, pumps=12, temperature=20.0, sus_stages=6,
+         sus_length=3.0, mirror_mass=80.0, power=150.0, roughness=10,
+         site=sites.Desert, material=materials.Sapphire),
+    2429549931.6502404, 34.379999999999995, 175, 983),
+   (dict(depth=50.0, pumps=3, temperature=100.0, sus_stages=1,
+         sus_length=0.5, mirror_mass=10.0, power=5.0, roughness=400,
+         site=sites.City, material=materials.Silica, freqrange=(0.5, 3.5)),
+    32065047.214696463, 6.0308834446919075, 0, 0),
+]
+
+# Relative tolerance of the ranges against the Simpson reference
+rangeTolerance = 1E-5
+
+
+def Calculator(detector):
+   return ScoreCalculator.Configured(detector,
+                                     detector.parameters['freqrange'])
+
+
+# NS-NS and BH-BH ranges of every configuration of the calculator's
+# detector, from Simpson's rule over a fine grid of the total PSD up to the
+# ISCO frequency of each binary
+def SimpsonRanges(calculator, points=100001):
+   f_isco, tmp = GetBinaryTerms(np.array([1.7, 47]), np.array([1.7, 47]))
+   ranges = []
+   for fHi, constant in zip(f_isco, tmp):
+      f = np.logspace(np.log10(calculator.fMin), np.log10(fHi), points)
+      integral = simpson(np.power(f, -7 / 3) / calculator.SensitivityLine(f),
+                         x=f, axis=-1)
+      ranges.append(DistanceFromIntegral(constant, integral))
+   return ranges
+
+
+@pytest.mark.parametrize('design, cost, complexity, nsns, bhbh', designs)
+def testSingleDetector(design, cost, complexity, nsns, bhbh):
+   detector = Detector(design)
+   calculator = Calculator(detector)
+   score = calculator.CalcScore()
+   nsnsRange, bhbhRange = SimpsonRanges(calculator)
+   assert score.nsnsRange == pytest.approx(nsnsRange, rel=rangeTolerance)
+   assert score.bhbhRange == pytest.approx(bhbhRange, rel=rangeTolerance)
+   assert type(score.nsns) is int and score.nsns == nsns
+   assert type(score.bhbh) is int and score.bhbh == bhbh
+   assert CalcCost(detector) == pytest.approx(cost, rel=1E-12)
+   assert CalcComplex(detector) == pytest.approx(complexity, rel=1E-12)
+
+
+@pytest.mark.parametrize('design, cost, complexity, nsns, bhbh', designs)
+def testAdaptiveIntegration(design, cost, complexity, nsns, bhbh):
+   calculator = Calculator(Detector(design))
+   calculator.SetIntegration(True)
+   score = calculator.CalcScore()
+   nsnsRange, bhbhRange = SimpsonRanges(calculator)
+   assert score.nsnsRange == pytest.approx(nsnsRange, rel=rangeTolerance)
+   assert score.bhbhRange == pytest.approx(bhbhRange, rel=rangeTolerance)
+   assert (score.nsns, score.bhbh) == (nsns, bhbh)
+
+
+def testBatchOfDesigns():
+   detectors = [Detector(dict(design, freqrange=(0, 4)))
+                for design, *pinned in designs]
+   calculator = Calculator(DetectorBatch.FromDetectors(detectors))
+   table = calculator.CalcScoreTable()
+   nsnsRange, bhbhRange = SimpsonRanges(calculator)
+   np.testing.assert_allclose(table['nsnsRange'], nsnsRange,
+                              rtol=rangeTolerance)
+   np.testing.assert_allclose(table['bhbhRange'], bhbhRange,
+                              rtol=rangeTolerance)
+   np.testing.assert_array_equal(table['nsns'],
+                                 [nsns for *rest, nsns, bhbh in designs])
+   np.testing.assert_array_equal(table['bhbh'],
+                                 [bhbh for *rest, nsns, bhbh in designs])
+   np.testing.assert_allclose(table['cost'],
+                              [cost for design, cost, *rest in designs],
+                              rtol=1E-12)
+   np.testing.assert_allclose(
+      table['complexity'],
+      [complexity for design, cost, complexity, *rest in designs], rtol=1E-12)
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def testRandomBatch(seed):
+   batch = RandomPopulation(16, method='lhs', seed=seed)
+   calculator = Calculator(batch)
+   table = calculator.CalcScoreTable()
+   nsnsRange, bhbhRange = SimpsonRanges(calculator)
+   np.testing.assert_allclose(table['nsnsRange'], nsnsRange,
+                              rtol=rangeTolerance)
+   np.testing.assert_allclose(table['bhbhRange'], bhbhRange,
+                              rtol=rangeTolerance)
+   # Every configuration scores as it does on its own
+   for i in range(batch.size):
+      single = Calculator(batch.GetDetector(i)).CalcScoreTable()
+      for key in single:
+         assert table[key][i] == pytest.approx(single[key], rel=1E-10), key
+
+
+def testCacheFollowsConstants(tmp_path):
+   detector = Detector(designs[1][0])
+   calculator = Calculator(detector)
+   calculator.SetResultCache(ResultCache(str(tmp_path)))
+   first = calculator.CalcScore().nsnsRange
+   assert calculator.CalcScore().nsnsRange == first
+   # The cache must not hand back the score of the old arm length
+   detector.constants['L'] = 2 * detector.constants['L']
+   longer = calculator.CalcScore().nsnsRange
+   assert longer != first
+   assert longer == pytest.approx(
+      Calculator(detector).CalcScore().nsnsRange, rel=1E-12)
+
+
+def testCachedCurvesAreReadOnly(tmp_path):
+   calculator = Calculator(Detector(designs[0][0]))
+   calculator.SetResultCache(ResultCache(str(tmp_path)))
+   calculator.GetNoiseCurves()
+   f, curves, names = calculator.GetNoiseCurves()
+   assert calculator.resultCache.hits == 1
+   with pytest.raises(ValueError):
+      curves[0][0] = 0
+   np.testing.assert_array_equal(calculator.GetNoiseCurves()[1][0],
+                                 Calculator(calculator.detector)
+                                 .GetNoiseCurves()[1][0])
+
+
+# Expression that only takes a single frequency
+scalarExpression = '1E-22 * (2 if f < 100 else 1)'
+
+
+def testPickledNoiseKeepsVectorized(monkeypatch):
+   noise = translate.CompileNoise('ScalarNoise', scalarExpression,
+                                  Detector(designs[0][0]))
+   assert not noise.vectorized
+   data = pickle.dumps(noise)
+   # As in a fresh worker process, which has compiled nothing yet
+   monkeypatch.setattr(translate, 'compiledNoises', {})
+   rebuilt = pickle.loads(data)
+   assert rebuilt is not noise
+   assert not rebuilt.vectorized
+
+
+def testCompiledNoiseProbedLater(monkeypatch):
+   monkeypatch.setattr(translate, 'compiledNoises', {})
+   noise = translate.CompileNoise('ScalarNoise', scalarExpression)
+   assert noise.vectorized
+   again = translate.CompileNoise('ScalarNoise', scalarExpression,
+                                  Detector(designs[0][0]))
+   assert again is noise
+   assert not noise.vectorized
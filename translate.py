@@ -1,3 +1,133 @@
+import copyreg
+import hashlib
+import re
+
+import numpy as np
+
+
+# Names available to noise expressions besides the translated parameters.
+# The numpy versions are used so that expressions work on whole arrays of
+# frequencies at once.
+expressionNames = {'np': np, 'pi': np.pi, 'sqrt': np.sqrt, 'exp': np.exp,
+                   'log': np.log, 'log10': np.log10, 'sin': np.sin,
+                   'cos': np.cos, 'tan': np.tan, 'abs': np.abs}
+
+# Frequencies used to check that a compiled expression broadcasts correctly
+probeFrequencies = np.logspace(0, 4, 8)
+
+# Compiled noise classes, keyed by a hash of their name and expression, so
+# compiling the same noise twice gives back the same class
+compiledNoises = {}
+
+
+# Type of the noise classes built from expressions. They are pickled as
+# their name and expression and compiled again on the other side, which lets
+# them be sent to worker processes.
+class CompiledNoise(type):
+   pass
+
+
+def ExpressionKey(className, expression):
+   return hashlib.sha1((className + '\n' + expression).encode()).hexdigest()
+
+
+# Parameters read by a translated expression, or None when it uses the
+# detector in some other way and its dependencies cannot be tracked
+def ExpressionDependencies(expression):
+   pattern = r"detector\.parameters\['(\w+)'\]"
+   if 'detector' in re.sub(pattern, '', expression):
+      return None
+   return list(dict.fromkeys(re.findall(pattern, expression)))
+
+
+# Build a noise model class from an already translated expression of f and
+# detector. Expressions that cannot take an array of frequencies are marked
+# as not vectorized and are evaluated point by point by the score
+# calculator. This is found by evaluating the expression for detector, or
+# given as vectorized; a class compiled without either is probed when it is
+# first compiled again with one.
+def CompileNoise(className, expression, detector=None, vectorized=None):
+   key = ExpressionKey(className, expression)
+   noise = compiledNoises.get(key)
+   if noise is None:
+      try:
+         code = compile('lambda f, detector: ' + expression,
+                        '<noise ' + className + '>', 'eval')
+      except SyntaxError as error:
+         raise ValueError('Noise ' + className + ' has an invalid '
+                          'expression: ' + expression) from error
+      function = eval(code, dict(expressionNames))
+
+      dependencies = ExpressionDependencies(expression)
+      attributes = {'expression': expression,
+                    'vectorized': True,
+                    'probed': False,
+                    'Get' + className: staticmethod(function),
+                    'ComputePoint': classmethod(
+                       lambda cls, f, detector: function(f, detector))}
+      if dependencies is not None:
+         attributes['dependencies'] = dependencies
+      noise = CompiledNoise(className, (), attributes)
+      compiledNoises[key] = noise
+
+   if not noise.probed:
+      if vectorized is not None:
+         noise.vectorized = bool(vectorized)
+         noise.probed = True
+      elif detector is not None:
+         noise.vectorized = CheckBroadcasting(
+            className, getattr(noise, 'Get' + className), detector)
+         noise.probed = True
+   return noise
+
+
+# Evaluate the expression on a column of probe frequencies. The result must
+# broadcast to the shape of the frequencies; an expression that only works
+# one frequency at a time must at least give a number.
+def CheckBroadcasting(className, function, detector):
+   fColumn = np.reshape(probeFrequencies,
+                        probeFrequencies.shape + (1,) * len(detector.shape))
+   shape = fColumn.shape[:1] + tuple(detector.shape)
+   try:
+      value = np.asarray(function(fColumn, detector), dtype=float)
+   except (TypeError, ValueError):
+      value = None
+   except Exception as error:
+      raise ValueError('Noise ' + className + ' could not be evaluated: '
+                       + str(error)) from error
+
+   if value is not None:
+      if np.broadcast_shapes(value.shape, shape) != shape:
+         raise ValueError('Noise ' + className + ' gives shape '
+                          + str(value.shape) + ' for frequencies of shape '
+                          + str(shape))
+      return True
+
+   try:
+      value = np.asarray(function(probeFrequencies[0], detector),
+                         dtype=float)
+   except Exception as error:
+      raise ValueError('Noise ' + className + ' could not be evaluated: '
+                       + str(error)) from error
+   if np.broadcast_shapes(value.shape, tuple(detector.shape)) != \
+         tuple(detector.shape):
+      raise ValueError('Noise ' + className + ' does not give one value '
+                       'per frequency')
+   return False
+
+
+# Compile a noise class sent to another process again, keeping whether it
+# is vectorized
+def RebuildNoise(className, expression, vectorized):
+   return CompileNoise(className, expression, vectorized=vectorized)
+
+
+copyreg.pickle(CompiledNoise,
+               lambda noise: (RebuildNoise, (noise.__name__,
+                                             noise.expression,
+                                             noise.vectorized)))
+
+
 class Translator:
 
    def __init__(self, detector, map={}):
@@ -5,6 +135,8 @@ class Translator:
       self.alphabet = 'abcdeghijklmnopqrstuvwxyz'
       self.detector = detector
       self.mapping = map
+      self.classnames = []
+      self.newClasses = {}
       if len(self.mapping) == 0:
          print('\nMap:\n')
          for i, key in enumerate(self.detector.parameters):
@@ -27,38 +159,21 @@ using the key printed above.
                 '\']')
       return string
 
-   def generateNoiseScript(self, noiseDictionary):
+   def compileNoiseClasses(self, noiseDictionary):
       # Takes a dictionary that defines a new noise function like
-      # {NoiseKey : 'FunctionString'}
-
-      # Create the new noise file
-      newNoiseFile = open('newnoises.py', 'w')
-      newNoiseFile.write('# User-defined noises\n\n')
-      self.classnames = []
+      # {NoiseKey : 'FunctionString'} and returns {NoiseKey : NoiseClass}
+      newClasses = {}
       for className in noiseDictionary:
-         self.classnames.append(className)
          function = self.translate(noiseDictionary[className])
-         newNoiseFile.write("""
-class {clsnm}:
-
-	@staticmethod
-	def Get{clsnm}(f, detector):
-		return {fnct}
-
-	@classmethod
-	def ComputePoint(cls, f, detector):
-		return cls.Get{clsnm}(f, detector)
-
-			""".format(clsnm=className, fnct=function))
+         newClasses[className] = CompileNoise(className, function,
+                                              self.detector)
+      return newClasses
 
-      newNoiseFile.close()
+   def generateNoiseScript(self, noiseDictionary):
+      # The classes are compiled in memory rather than written to a script,
+      # so several sessions can define noises at once
+      self.newClasses = self.compileNoiseClasses(noiseDictionary)
+      self.classnames = list(self.newClasses)
 
    def getNewNoiseClasses(self):
-      import newnoises
-      newClasses = {}
-      for key in newnoises.__dict__:
-         for clsnm in self.classnames:
-            if clsnm in key:
-               newClasses[clsnm] = newnoises.__dict__[key]
-
-      return newClasses
+      return dict(self.newClasses)